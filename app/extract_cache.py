@@ -0,0 +1,60 @@
+"""
+Cache em disco dos resultados de extração, indexado pelo SHA256 do arquivo
+(prefixado pela versão do prompt, ver extractors._cache_key).
+Reenvios do mesmo comprovante não geram nova chamada à OpenAI.
+Requer diskcache (opcional); sem ele o cache fica desativado.
+"""
+import hashlib
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(__file__).parent / '_extract_cache'
+CACHE_SIZE_LIMIT = 500 * 1024 * 1024  # 500 MB
+CACHE_EXPIRE = 7 * 86400  # 7 dias
+SHA256_CHUNK = 1 << 16  # 64 KB
+
+try:
+    import diskcache
+    _cache = diskcache.Cache(str(CACHE_DIR), size_limit=CACHE_SIZE_LIMIT)
+except Exception as e:
+    _cache = None
+    logger.debug("Cache de extração desativado: %s", e)
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA256 do arquivo via mmap, em blocos de 64 KB (sem copiar o conteúdo para bytes)."""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        # mmap não aceita arquivo vazio
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as mv:
+            for i in range(0, len(mv), SHA256_CHUNK):
+                h.update(mv[i:i + SHA256_CHUNK])
+    return h.hexdigest()
+
+
+def lookup(key: str) -> Optional[Dict]:
+    """Resultado em cache para a chave (SHA256 + versão do prompt), ou None."""
+    if _cache is None:
+        return None
+    try:
+        return _cache.get(key)
+    except Exception as e:
+        logger.warning("⚠️ Erro ao ler cache de extração: %s", e)
+        return None
+
+
+def store(key: str, result: Dict):
+    """Grava resultado de extração bem-sucedida."""
+    if _cache is None:
+        return
+    try:
+        _cache.set(key, result, expire=CACHE_EXPIRE)
+    except Exception as e:
+        logger.warning("⚠️ Erro ao gravar cache de extração: %s", e)
@@ -2,10 +2,13 @@
 import os
 import json
 import base64
+import asyncio
 import logging
-import time
+import mmap
+import threading
+import weakref
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from PIL import Image
 import io
 from dotenv import load_dotenv
@@ -16,114 +19,161 @@ if env_path.exists():
     load_dotenv(dotenv_path=env_path)
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
     api_key = os.getenv("OPENAI_API_KEY")
-    client = OpenAI(api_key=api_key) if api_key else None
     if api_key:
         logger_temp = logging.getLogger(__name__)
-        logger_temp.info(f"✅ OpenAI configurado (key: {api_key[:20]}...)")
+        logger_temp.info("✅ OpenAI configurado (key: %s...)", api_key[:20])
 except Exception as e:
-    client = None
+    api_key = None
     logger_temp = logging.getLogger(__name__)
-    logger_temp.warning(f"⚠️ OpenAI não configurado: {e}")
+    logger_temp.warning("⚠️ OpenAI não configurado: %s", e)
 
 # Try to import PDF libraries
+# PyMuPDF renderiza/extrai in-process (sem subprocesso do poppler); pdf2image/pdfplumber são fallback
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
 try:
     from pdf2image import convert_from_path
     PDF_SUPPORT = True
 except:
-    PDF_SUPPORT = False
+    PDF_SUPPORT = pymupdf is not None
 
 try:
     import pdfplumber
     PDF_TEXT_SUPPORT = True
 except:
-    PDF_TEXT_SUPPORT = False
+    PDF_TEXT_SUPPORT = pymupdf is not None
+
+# OpenCV (opcional): encode JPEG mais rápido que o Pillow
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
 
 logger = logging.getLogger(__name__)
 
-# Rate limiting: adicionar delay entre chamadas para evitar 429
-last_openai_call_time = 0
-MIN_CALL_INTERVAL = 5.0  # 5 segundos entre chamadas = ~12 chamadas/minuto (reduz rate limit 429s)
+try:
+    from .openai_limiter import AsyncLimiter
+    from .money import parse_brl
+    from . import extract_cache
+except ImportError:
+    from openai_limiter import AsyncLimiter
+    from money import parse_brl
+    import extract_cache
+
+# Rate limiting: intervalo entre disparos + limite de requisições simultâneas
+MIN_CALL_INTERVAL = float(os.getenv('OPENAI_MIN_CALL_INTERVAL', '5.0'))  # 5s = ~12 chamadas/minuto (reduz 429s)
+OPENAI_CONCURRENCY = int(os.getenv('OPENAI_CONCURRENCY', '4'))
+openai_limiter = AsyncLimiter(rps=1.0 / MIN_CALL_INTERVAL, concurrency=OPENAI_CONCURRENCY)
+
+# O AsyncOpenAI (pool httpx) fica preso ao event loop em que foi usado: um cliente por loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def _client() -> "AsyncOpenAI":
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        client = _clients.get(loop)
+        if client is None:
+            # max_retries=0: o retry/backoff em 429 fica a cargo do AsyncLimiter
+            client = _clients[loop] = AsyncOpenAI(api_key=api_key, max_retries=0)
+        return client
+
+# Acima disso a OpenAI Vision descarta resolução; reduzir antes economiza upload
+MAX_IMAGE_DIM = 1568
+JPEG_QUALITY = 85
 
 # Importar extrator de PDF por texto
 try:
-    from pdf_extractor import extract_from_pdf_text
-except:
-    def extract_from_pdf_text(file_path):
-        return None
+    from .pdf_extractor import extract_from_pdf_text
+except ImportError:
+    try:
+        from pdf_extractor import extract_from_pdf_text
+    except ImportError:
+        def extract_from_pdf_text(file_path, doc=None):
+            return None
 
 def encode_image(fp: str) -> str:
+    """Base64 do arquivo via mmap (evita copiar o conteúdo para um buffer Python)"""
     with open(fp, 'rb') as f:
-        return base64.b64encode(f.read()).decode('utf-8')
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode('ascii')
 
-def pdf_to_image(pdf_path: str) -> str:
-    """Converte a primeira página de um PDF em imagem JPEG temporária"""
-    if not PDF_SUPPORT:
-        raise Exception("pdf2image não instalado. Execute: pip install pdf2image")
-    
-    try:
-        # Converter primeira página do PDF
-        images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=200)
-        
-        if not images:
-            raise Exception("Não foi possível converter PDF")
-        
-        # Salvar como JPEG temporário
-        temp_path = pdf_path.replace('.pdf', '_temp.jpg')
-        images[0].save(temp_path, 'JPEG', quality=95)
-        
-        logger.info(f"📄 PDF convertido para imagem: {temp_path}")
-        return temp_path
-        
-    except Exception as e:
-        logger.error(f"Erro ao converter PDF: {e}")
-        raise
+def _encode_jpeg(img: Image.Image) -> bytes:
+    """Codifica uma imagem PIL como JPEG (sem EXIF), via OpenCV quando disponível"""
+    img = img.convert('RGB')
+    if cv2 is not None:
+        bgr = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR)
+        ok, buf = cv2.imencode('.jpg', bgr, [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY,
+                                             int(cv2.IMWRITE_JPEG_OPTIMIZE), 1,
+                                             int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1])
+        if ok:
+            return buf.tobytes()
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
 
-def extract_proof_data(file_path: str) -> Dict:
-    global last_openai_call_time
-    
-    if not client:
-        return {'value': None, 'sender_pix_key': None, 'receiver_pix_key': None, 'success': False, 'error': 'OpenAI not configured'}
-    
-    # OTIMIZAÇÃO: Para PDFs, tentar extrair texto primeiro (GRÁTIS!)
-    ext = Path(file_path).suffix.lower()
-    if ext == '.pdf' and PDF_TEXT_SUPPORT:
-        logger.info(f"🔍 Tentando extrair texto do PDF (sem OpenAI)...")
-        pdf_data = extract_from_pdf_text(file_path)
+def image_to_b64(fp: str, ext: str) -> Tuple[str, str]:
+    """Base64 da imagem, reduzida para no máximo MAX_IMAGE_DIM px no maior lado"""
+    mime = 'image/jpeg' if ext in ['.jpg', '.jpeg'] else 'image/png'
+    with Image.open(fp) as img:
+        if max(img.size) <= MAX_IMAGE_DIM:
+            return encode_image(fp), mime
         
-        if pdf_data and pdf_data.get('success'):
-            logger.info(f"✅ PDF processado localmente - ECONOMIA de 1 requisição OpenAI!")
-            return pdf_data
-        else:
-            logger.info(f"⚠️ Extração de texto falhou, usando OpenAI Vision como fallback...")
+        ratio = MAX_IMAGE_DIM / max(img.size)
+        new_size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        resized = img.resize(new_size, Image.LANCZOS)
     
-    # Rate limiting: aguardar intervalo mínimo entre chamadas
-    current_time = time.time()
-    time_since_last_call = current_time - last_openai_call_time
-    if time_since_last_call < MIN_CALL_INTERVAL:
-        sleep_time = MIN_CALL_INTERVAL - time_since_last_call
-        logger.info(f"⏳ Rate limiting: aguardando {sleep_time:.2f}s...")
-        time.sleep(sleep_time)
+    data = _encode_jpeg(resized)
+    logger.debug("🖼️ Imagem reduzida para %dx%d (%d bytes)", new_size[0], new_size[1], len(data))
+    return base64.b64encode(data).decode('ascii'), 'image/jpeg'
+
+def pdf_to_b64(pdf_path: str, doc=None) -> Tuple[str, str]:
+    """Renderiza a primeira página do PDF como JPEG em memória e retorna (b64, mime)
+    doc: documento PyMuPDF já aberto (opcional), para não reabrir o arquivo
+    """
+    if not PDF_SUPPORT:
+        raise Exception("pdf2image não instalado. Execute: pip install pymupdf (ou pdf2image)")
     
     try:
-        if ext not in ['.jpg', '.jpeg', '.png', '.pdf']:
-            return {'value': None, 'sender_pix_key': None, 'receiver_pix_key': None, 'success': False, 'error': 'Unsupported file'}
-        
-        # Converter PDF para imagem se necessário
-        temp_file = None
-        if ext == '.pdf':
-            if not PDF_SUPPORT:
-                return {'value': None, 'sender_pix_key': None, 'receiver_pix_key': None, 'success': False, 'error': 'PDF não suportado. Instale: pip install pdf2image'}
+        # 150 DPI basta: a OpenAI Vision redimensiona para 768px no lado menor
+        if pymupdf is not None:
+            opened = doc if doc is not None else pymupdf.open(pdf_path)
+            try:
+                pix = opened[0].get_pixmap(dpi=150)
+                data = pix.tobytes('jpeg', jpg_quality=JPEG_QUALITY)
+            finally:
+                if doc is None:
+                    opened.close()
+        else:
+            images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=150, fmt='jpeg')
+            
+            if not images:
+                raise Exception("Não foi possível converter PDF")
             
-            file_path = pdf_to_image(file_path)
-            temp_file = file_path  # Marcar para deletar depois
-            ext = '.jpg'
+            data = _encode_jpeg(images[0])
         
-        b64 = encode_image(file_path)
-        mime = 'image/jpeg' if ext in ['.jpg', '.jpeg'] else 'image/png'
+        logger.debug("📄 PDF convertido para imagem (%d bytes)", len(data))
+        return base64.b64encode(data).decode('ascii'), 'image/jpeg'
         
-        prompt = """Analise este comprovante de transferência PIX e extraia as seguintes informações em formato JSON:
+    except Exception as e:
+        logger.error("Erro ao converter PDF: %s", e)
+        raise
+
+# Alterar o prompt exige novo _PROOF_PROMPT_VERSION: a versão compõe a chave do cache
+_PROOF_PROMPT_VERSION = 'v3-2024-11'
+
+_PROOF_PROMPT = """Analise este comprovante de transferência PIX e extraia as seguintes informações em formato JSON:
 
 {
   "valor": 0.0,
@@ -188,83 +238,209 @@ ATENÇÃO ESPECIAL:
 - Se ver "88d663a9-3c79-48c8-8b86-16d583c553c3", retorne EXATAMENTE assim
 - Não omita zeros à esquerda em CNPJs/CPFs
 - Retorne APENAS o JSON válido, sem markdown ou explicações"""
+
+_BATCH_PROMPT = """Você receberá {n} comprovantes PIX, um por imagem, na ordem enviada.
+Extraia de CADA imagem os campos descritos abaixo e retorne um objeto JSON no formato:
+
+{{"items": [{{...campos da imagem 1...}}, {{...campos da imagem 2...}}]}}
+
+O array "items" deve ter exatamente {n} objetos, na mesma ordem das imagens.
+
+"""
+
+def _error_result(error: str) -> Dict:
+    return {'value': None, 'sender_pix_key': None, 'receiver_pix_key': None, 'success': False, 'error': error}
+
+def _cache_key(sha: str) -> str:
+    return f'{_PROOF_PROMPT_VERSION}:{sha}'
+
+def _file_sha(file_path: str, sha: str = None) -> Optional[str]:
+    try:
+        return sha or extract_cache.file_sha256(file_path)
+    except OSError:
+        return None
+
+async def _prepare(file_path: str, sha: Optional[str]) -> Tuple[Optional[Dict], Optional[Tuple[str, str]]]:
+    """Etapas locais antes da OpenAI: cache, texto do PDF e conversão para base64.
+    Retorna (resultado, None) se já há resposta final, ou (None, (b64, mime)).
+    """
+    # Reenvio do mesmo arquivo: reaproveita o resultado anterior (sha pode vir do chamador)
+    if sha:
+        cached = extract_cache.lookup(_cache_key(sha))
+        if cached is not None:
+            logger.debug("⚡ Resultado em cache para %s...", sha[:16])
+            return cached, None
+    
+    if not api_key:
+        return _error_result('OpenAI not configured'), None
+    
+    ext = Path(file_path).suffix.lower()
+    if ext == '.pdf' and pymupdf is not None:
+        # Um único documento aberto serve para a extração de texto e para a renderização
+        try:
+            doc = await asyncio.to_thread(pymupdf.open, file_path)
+        except Exception as e:
+            logger.error('Erro ao abrir PDF: %s', e)
+            return _error_result(str(e)), None
+        try:
+            return await _prepare_pdf(file_path, sha, doc)
+        finally:
+            doc.close()
+    if ext == '.pdf':
+        return await _prepare_pdf(file_path, sha, None)
+    
+    if ext not in ['.jpg', '.jpeg', '.png']:
+        return _error_result('Unsupported file'), None
+    
+    try:
+        return None, await asyncio.to_thread(image_to_b64, file_path, ext)
+    except Exception as e:
+        logger.error('Erro ao preparar imagem: %s', e)
+        return _error_result(str(e)), None
+
+async def _prepare_pdf(file_path: str, sha: Optional[str], doc) -> Tuple[Optional[Dict], Optional[Tuple[str, str]]]:
+    # OTIMIZAÇÃO: Para PDFs, tentar extrair texto primeiro (GRÁTIS!)
+    if PDF_TEXT_SUPPORT:
+        logger.debug("🔍 Tentando extrair texto do PDF (sem OpenAI)...")
+        # Trabalho de CPU/disco: roda fora do event loop
+        pdf_data = await asyncio.to_thread(extract_from_pdf_text, file_path, doc)
         
-        # Atualizar timestamp antes da chamada
-        last_openai_call_time = time.time()
-        
-        resp = client.chat.completions.create(
+        if pdf_data and pdf_data.get('success'):
+            logger.debug("✅ PDF processado localmente - ECONOMIA de 1 requisição OpenAI!")
+            if sha:
+                extract_cache.store(_cache_key(sha), pdf_data)
+            return pdf_data, None
+        else:
+            logger.info("⚠️ Extração de texto falhou, usando OpenAI Vision como fallback...")
+    
+    if not PDF_SUPPORT:
+        return _error_result('PDF não suportado. Instale: pip install pymupdf (ou pdf2image)'), None
+    
+    try:
+        # Converter PDF para imagem (em memória)
+        return None, await asyncio.to_thread(pdf_to_b64, file_path, doc)
+    except Exception as e:
+        logger.error('Erro ao preparar imagem: %s', e)
+        return _error_result(str(e)), None
+
+def _result_from_json(r: Dict) -> Dict:
+    """Converte o JSON retornado pela OpenAI no formato de resultado do extrator"""
+    v = r.get('valor') or r.get('value')
+    if isinstance(v, str):
+        v = parse_brl(v)
+    elif v is None:
+        v = 0
+    
+    return {
+        'value': v,
+        'sender_pix_key': r.get('chave_pix_remetente'),
+        'receiver_pix_key': r.get('chave_pix_destinatario'),
+        'beneficiary': r.get('beneficiario'),
+        'endtoend': r.get('endtoend'),
+        'date': r.get('data'),
+        'confidence': 0.95 if v else 0.5,
+        'success': bool(v and v > 0),
+        'error': None
+    }
+
+def _image_content(b64: str, mime: str) -> Dict:
+    return {'type': 'image_url', 'image_url': {'url': f'data:{mime};base64,{b64}'}}
+
+async def _extract_single(b64: str, mime: str, sha: Optional[str]) -> Dict:
+    """Uma chamada à OpenAI Vision para uma imagem já codificada"""
+    try:
+        # Rate limiting (não bloqueia a thread) + backoff em 429
+        resp = await openai_limiter.call(
+            _client().chat.completions.create,
             model='gpt-4o-mini',
             messages=[{'role':'user','content':[
-                {'type':'text','text': prompt},
-                {'type':'image_url','image_url':{'url':f'data:{mime};base64,{b64}'}}
+                {'type':'text','text': _PROOF_PROMPT},
+                _image_content(b64, mime)
             ]}],
-            max_tokens=500,
+            # JSON mode: resposta sempre é um objeto JSON válido (sem markdown)
+            response_format={'type': 'json_object'},
+            max_tokens=300,
             temperature=0.1
         )
         
-        raw = resp.choices[0].message.content.strip()
-        if '```' in raw:
-            raw = raw.split('```')[1].replace('json','').strip()
-        
-        r = json.loads(raw)
-        v = r.get('valor') or r.get('value')
-        if isinstance(v, str):
-            # Remover R$ e espaços
-            v = v.replace('R$','').strip()
-            
-            # Lógica de conversão do formato brasileiro:
-            # 49.850,00 -> 49850.00 (valor com centavos)
-            # 49.850 -> 49850.00 (valor sem centavos)
-            # 49,85 -> 49.85 (valor pequeno com centavos)
-            
-            if ',' in v:
-                # Tem vírgula = formato brasileiro com centavos
-                # Remove pontos (separadores de milhar) e troca vírgula por ponto
-                v = v.replace('.', '').replace(',', '.')
-            else:
-                # Não tem vírgula, só ponto
-                # Verificar se é separador de milhar ou decimal
-                parts = v.split('.')
-                if len(parts) == 2 and len(parts[1]) <= 2:
-                    # Tem ponto com 1-2 dígitos após = decimal (formato americano)
-                    # Ex: 49.85 -> manter como está
-                    pass
-                else:
-                    # Tem ponto com 3+ dígitos = separador de milhar
-                    # Ex: 49.850 -> remover ponto
-                    v = v.replace('.', '')
-            
-            v = float(v or 0)
-        elif v is None:
-            v = 0
-        
-        # Deletar arquivo temporário se foi criado
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-                logger.info(f"🗑️ Arquivo temporário removido: {temp_file}")
-            except:
-                pass
-        
-        return {
-            'value': v,
-            'sender_pix_key': r.get('chave_pix_remetente'),
-            'receiver_pix_key': r.get('chave_pix_destinatario'),
-            'beneficiary': r.get('beneficiario'),
-            'endtoend': r.get('endtoend'),
-            'date': r.get('data'),
-            'confidence': 0.95 if v else 0.5,
-            'success': bool(v and v > 0),
-            'error': None
-        }
+        result = _result_from_json(json.loads(resp.choices[0].message.content))
+        if sha and result['success']:
+            extract_cache.store(_cache_key(sha), result)
+        return result
     except Exception as e:
-        logger.error(f'OpenAI error: {e}')
-        
-        # Limpar arquivo temporário em caso de erro
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except:
-                pass
-        
-        return {'value': None, 'sender_pix_key': None, 'receiver_pix_key': None, 'success': False, 'error': str(e)}
+        logger.error('OpenAI error: %s', e)
+        return _error_result(str(e))
+
+async def extract_proof_data(file_path: str, sha: str = None) -> Dict:
+    sha = _file_sha(file_path, sha)
+    result, image = await _prepare(file_path, sha)
+    if result is not None:
+        return result
+    return await _extract_single(*image, sha)
+
+async def extract_proof_data_batch(file_paths: List[str]) -> List[Dict]:
+    """Extrai vários comprovantes (ex.: um media group) numa única chamada à OpenAI.
+    Cache e texto de PDF são tentados por arquivo antes; se a chamada em lote
+    falhar, cada arquivo pendente é processado individualmente.
+    """
+    results: List[Optional[Dict]] = [None] * len(file_paths)
+    pending = []  # (índice, sha, b64, mime)
+    
+    for i, fp in enumerate(file_paths):
+        sha = _file_sha(fp)
+        result, image = await _prepare(fp, sha)
+        if result is not None:
+            results[i] = result
+        else:
+            pending.append((i, sha, *image))
+    
+    if len(pending) == 1:
+        i, sha, b64, mime = pending[0]
+        results[i] = await _extract_single(b64, mime, sha)
+    elif pending:
+        try:
+            content = [{'type': 'text', 'text': _BATCH_PROMPT.format(n=len(pending)) + _PROOF_PROMPT}]
+            content += [_image_content(b64, mime) for _, _, b64, mime in pending]
+            resp = await openai_limiter.call(
+                _client().chat.completions.create,
+                model='gpt-4o-mini',
+                messages=[{'role': 'user', 'content': content}],
+                response_format={'type': 'json_object'},
+                max_tokens=300 * len(pending),
+                temperature=0.1
+            )
+            items = json.loads(resp.choices[0].message.content).get('items')
+            if not isinstance(items, list) or len(items) != len(pending):
+                raise ValueError(f'lote retornou {len(items) if isinstance(items, list) else 0} itens, esperado {len(pending)}')
+            
+            for (i, sha, _, _), item in zip(pending, items):
+                results[i] = _result_from_json(item)
+                if sha and results[i]['success']:
+                    extract_cache.store(_cache_key(sha), results[i])
+        except Exception as e:
+            logger.warning('⚠️ Extração em lote falhou (%s), processando individualmente...', e)
+            for i, sha, b64, mime in pending:
+                results[i] = await _extract_single(b64, mime, sha)
+    
+    return results
+
+# Chamadores síncronos (threads do bot): um event loop de fundo compartilhado,
+# alimentado via run_coroutine_threadsafe, em vez de um asyncio.run() por chamada
+_bg_loop: Optional[asyncio.AbstractEventLoop] = None
+_bg_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _bg_loop
+    with _bg_loop_lock:
+        if _bg_loop is None:
+            _bg_loop = asyncio.new_event_loop()
+            threading.Thread(target=_bg_loop.run_forever, name='openai-loop', daemon=True).start()
+        return _bg_loop
+
+def extract_proof_data_sync(file_path: str, sha: str = None) -> Dict:
+    """Versão bloqueante de extract_proof_data para código em threads (não chamar de dentro de um event loop)."""
+    return asyncio.run_coroutine_threadsafe(extract_proof_data(file_path, sha), _background_loop()).result()
+
+def extract_proof_data_batch_sync(file_paths: List[str]) -> List[Dict]:
+    """Versão bloqueante de extract_proof_data_batch."""
+    return asyncio.run_coroutine_threadsafe(extract_proof_data_batch(file_paths), _background_loop()).result()
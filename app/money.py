@@ -0,0 +1,40 @@
+"""
+Conversão de valores monetários em formato brasileiro (BRL).
+"""
+
+# Remove "R$", espaços (inclusive NBSP) e tabs numa única passada
+_BRL_STRIP = str.maketrans('', '', 'R$ \t\xa0')
+
+
+def parse_brl(s: str) -> float:
+    """Converte um valor em reais para float.
+
+    Regras:
+      - com vírgula: formato brasileiro, pontos são separadores de milhar
+      - só ponto com 1-2 dígitos depois: decimal (formato americano)
+      - só ponto com 3+ dígitos depois: separador de milhar
+
+    >>> parse_brl('R$ 49.500,00')
+    49500.0
+    >>> parse_brl('49,85')
+    49.85
+    >>> parse_brl('49.85')
+    49.85
+    >>> parse_brl('500.000,00')
+    500000.0
+    >>> parse_brl('1.234,56')
+    1234.56
+    >>> parse_brl('49.850')
+    49850.0
+    >>> parse_brl('\\n')
+    0.0
+    """
+    s = s.strip().translate(_BRL_STRIP)
+    if not s:
+        return 0.0
+    if ',' in s:
+        return float(s.replace('.', '').replace(',', '.'))
+    parts = s.split('.')
+    if len(parts) == 2 and len(parts[1]) <= 2:
+        return float(s)
+    return float(s.replace('.', ''))
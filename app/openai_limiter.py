@@ -0,0 +1,74 @@
+"""
+Rate limiter assíncrono para chamadas à OpenAI.
+Combina um semáforo (concorrência global) com um espaçamento mínimo entre
+disparos (RPS), sem bloquear a thread como o antigo time.sleep().
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Backoff exponencial em HTTP 429: 1s -> 2s -> 4s
+MAX_RETRIES = 3
+INITIAL_BACKOFF = 1.0
+
+
+def _is_rate_limit_error(exc: Exception) -> bool:
+    """Detecta 429 tanto em erros da lib openai quanto do httpx."""
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        response = getattr(exc, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status == 429
+
+
+class AsyncLimiter:
+    """Limita requisições por segundo e requisições simultâneas em voo."""
+
+    def __init__(self, rps: float, concurrency: int):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self.concurrency = max(1, concurrency)
+        self.next_slot = 0.0
+        # Semáforo por event loop: Lock/Semaphore do asyncio ficam presos ao loop
+        # que os usou primeiro, e cada asyncio.run() cria um loop novo.
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        # A reserva do horário não aguarda nada: um lock de thread vale para todos os loops
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            sem = self._sems.get(loop)
+            if sem is None:
+                sem = self._sems[loop] = asyncio.Semaphore(self.concurrency)
+            return sem
+
+    async def _wait_slot(self):
+        """Reserva o próximo horário livre e aguarda até ele chegar."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            logger.debug("⏳ Rate limiting: aguardando %.2fs...", delay)
+            await asyncio.sleep(delay)
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Executa func(*args, **kwargs) respeitando os limites, com retry em 429."""
+        backoff = INITIAL_BACKOFF
+        async with self._semaphore():
+            for attempt in range(MAX_RETRIES + 1):
+                await self._wait_slot()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= MAX_RETRIES or not _is_rate_limit_error(e):
+                        raise
+                    logger.warning("⚠️ OpenAI 429, nova tentativa em %.0fs (%d/%d)", backoff, attempt + 1, MAX_RETRIES)
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
@@ -9,14 +9,37 @@ from datetime import datetime
 
 try:
     import pdfplumber
-    PDF_TEXT_SUPPORT = True
 except:
-    PDF_TEXT_SUPPORT = False
+    pdfplumber = None
+
+# PyMuPDF (opcional): extração de texto in-process, bem mais rápida que o pdfplumber
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+PDF_TEXT_SUPPORT = pdfplumber is not None or pymupdf is not None
+
+# Opcional: varredura multi-padrão em uma única passada
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+try:
+    from .money import parse_brl
+except ImportError:
+    from money import parse_brl
 
 logger = logging.getLogger(__name__)
 
 # Padrões regex para extração de dados de comprovantes PIX
-PATTERNS = {
+# O intervalo entre rótulo e chave é limitado a .{0,200}? (em vez de .*?) para
+# evitar backtracking excessivo em PDFs longos.
+_RAW_PATTERNS = {
     'valor': [
         r'Valor[:\s]*R?\$?\s*([\d.,]+)',  # "Valor: R$ 49.500,00"
         r'R\$\s*([\d.,]+)',  # "R$ 49.500,00"
@@ -25,35 +48,35 @@ PATTERNS = {
     ],
     'pix_remetente': [
         # UUID (chave aleatória) - prioridade alta
-        r'(?:pagador|origem|de|remetente|quem\s+enviou).*?(?:chave|pix)[:\s]*([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
-        r'(?:chave|pix)[:\s]*(?:pagador|origem|de|remetente).*?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
-        r'(?:pagador|origem|de|remetente).*?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:pagador|origem|de|remetente|quem\s+enviou).{0,200}?(?:chave|pix)[:\s]*([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:chave|pix)[:\s]*(?:pagador|origem|de|remetente).{0,200}?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:pagador|origem|de|remetente).{0,200}?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
         # CNPJ formatado (XX.XXX.XXX/XXXX-XX)
-        r'(?:pagador|origem|de|remetente).*?(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
+        r'(?:pagador|origem|de|remetente).{0,200}?(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
         # CNPJ sem formatação (14 dígitos)
-        r'(?:pagador|origem|de|remetente).*?(\d{14})',
+        r'(?:pagador|origem|de|remetente).{0,200}?(\d{14})',
         # CPF (11 dígitos)
-        r'(?:pagador|origem|de|remetente).*?(\d{11})',
+        r'(?:pagador|origem|de|remetente).{0,200}?(\d{11})',
         # Email
-        r'(?:pagador|origem|de|remetente).*?([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
+        r'(?:pagador|origem|de|remetente).{0,200}?([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
         # Telefone
-        r'(?:pagador|origem|de|remetente).*?(\+55\s*\d{2}\s*\d{4,5}[-\s]?\d{4})',
+        r'(?:pagador|origem|de|remetente).{0,200}?(\+55\s*\d{2}\s*\d{4,5}[-\s]?\d{4})',
     ],
     'pix_destinatario': [
         # UUID (chave aleatória) - prioridade alta
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio|quem\s+recebeu).*?(?:chave|pix)[:\s]*([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
-        r'(?:chave|pix)[:\s]*(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio|quem\s+recebeu).{0,200}?(?:chave|pix)[:\s]*([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:chave|pix)[:\s]*(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})',
         # CNPJ formatado (XX.XXX.XXX/XXXX-XX)
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
         # CNPJ sem formatação (14 dígitos) - captura números completos
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?(\d{14})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?(\d{14})',
         # CPF (11 dígitos)
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?(\d{11})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?(\d{11})',
         # Email
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})',
         # Telefone
-        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).*?(\+55\s*\d{2}\s*\d{4,5}[-\s]?\d{4})',
+        r'(?:favorecido|destinat[aá]rio|recebedor|para|benefici[aá]rio).{0,200}?(\+55\s*\d{2}\s*\d{4,5}[-\s]?\d{4})',
     ],
     'beneficiario': [
         r'(?:favorecido|benefici[aá]rio|nome)[:\s]+([A-ZÀ-Ú][A-ZÀ-Ú\s]{2,50})',
@@ -69,135 +92,219 @@ PATTERNS = {
     ]
 }
 
-def extract_from_pdf_text(pdf_path: str) -> Dict:
+# Compilados uma única vez na importação (flags embutidas)
+PATTERNS = {
+    field: [re.compile(p, re.IGNORECASE | re.DOTALL) for p in patterns]
+    for field, patterns in _RAW_PATTERNS.items()
+}
+
+# id do padrão no banco Hyperscan -> (campo, prioridade)
+_PATTERN_IDS = [
+    (field, priority)
+    for field, patterns in _RAW_PATTERNS.items()
+    for priority in range(len(patterns))
+]
+
+
+def _build_hyperscan_db():
+    """Compila todos os padrões num único banco Hyperscan (None se indisponível).
+
+    Hyperscan não devolve grupos de captura, então é usado como pré-filtro:
+    HS_FLAG_PREFILTER só amplia os padrões, e a varredura usa o texto normalizado
+    por _HS_NORMALIZE, de modo que nenhum padrão que casaria no `re` fique de fora.
+    """
+    if hyperscan is None:
+        return None
+    try:
+        flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_DOTALL | hyperscan.HS_FLAG_UTF8 |
+                 hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_PREFILTER | hyperscan.HS_FLAG_SINGLEMATCH)
+        expressions = [_RAW_PATTERNS[field][priority].encode('utf-8') for field, priority in _PATTERN_IDS]
+        db = hyperscan.Database()
+        db.compile(
+            expressions=expressions,
+            ids=list(range(len(expressions))),
+            elements=len(expressions),
+            flags=[flags] * len(expressions),
+        )
+        return db
+    except Exception as e:
+        logger.warning("⚠️ Hyperscan indisponível, usando regex padrão: %s", e)
+        return None
+
+HS_DB = _build_hyperscan_db()
+
+# Onde `re` e Hyperscan divergem, o texto varrido (só ele) é normalizado para o
+# pré-filtro continuar cobrindo todo casamento do `re`:
+#   - \x1c-\x1f são \s para o `re`, mas não para o Hyperscan (UCP segue White_Space do Unicode)
+#   - İ ı ſ K casam com i/s/k no `re` com IGNORECASE, mas não no caseless do Hyperscan
+_HS_NORMALIZE = str.maketrans('\x1c\x1d\x1e\x1f\u0130\u0131\u017f\u212a', '    iisk')
+
+
+def _candidate_patterns(text: str) -> Dict[str, list]:
+    """Retorna, por campo, apenas os padrões que têm chance de casar no texto.
+
+    Com Hyperscan o texto é percorrido uma única vez; a ordem de prioridade de
+    cada campo é preservada. Sem Hyperscan, devolve PATTERNS inteiro.
+    """
+    if HS_DB is None:
+        return PATTERNS
+    
+    hits = set()
+    
+    def on_match(pattern_id, start, end, flags, context):
+        hits.add(pattern_id)
+    
+    try:
+        HS_DB.scan(text.translate(_HS_NORMALIZE).encode('utf-8'), match_event_handler=on_match)
+    except Exception as e:
+        logger.warning("⚠️ Falha na varredura Hyperscan, usando regex padrão: %s", e)
+        return PATTERNS
+    
+    candidates = {field: [] for field in PATTERNS}
+    for pattern_id in sorted(hits):
+        field, priority = _PATTERN_IDS[pattern_id]
+        candidates[field].append(PATTERNS[field][priority])
+    return candidates
+
+
+def _try_extract(text: str) -> Dict:
+    """Aplica os padrões regex sobre o texto já extraído do PDF."""
+    # Extrair dados usando regex
+    data = {
+        'value': None,
+        'sender_pix_key': None,
+        'receiver_pix_key': None,
+        'beneficiary': None,
+        'endtoend': None,
+        'date': None,
+        'method': 'pdf_text'
+    }
+    
+    candidates = _candidate_patterns(text)
+    
+    # Valor
+    for pattern in candidates['valor']:
+        match = pattern.search(text)
+        if match:
+            value_str = match.group(1).strip()
+            
+            try:
+                data['value'] = parse_brl(value_str)
+                logger.debug("💰 Valor encontrado: R$ %.2f", data['value'])
+                break
+            except Exception as e:
+                logger.warning("⚠️ Erro ao converter valor '%s': %s", value_str, e)
+                continue
+    
+    # PIX Remetente
+    for pattern in candidates['pix_remetente']:
+        match = pattern.search(text)
+        if match:
+            data['sender_pix_key'] = match.group(1).strip()
+            logger.debug("👤 PIX Remetente encontrado: %s", data['sender_pix_key'])
+            break
+    
+    # PIX Destinatário
+    for pattern in candidates['pix_destinatario']:
+        match = pattern.search(text)
+        if match:
+            data['receiver_pix_key'] = match.group(1).strip()
+            logger.debug("🎯 PIX Destinatário encontrado: %s", data['receiver_pix_key'])
+            break
+    
+    # Beneficiário
+    for pattern in candidates['beneficiario']:
+        match = pattern.search(text)
+        if match:
+            data['beneficiary'] = match.group(1).strip()
+            logger.debug("📝 Beneficiário: %s", data['beneficiary'])
+            break
+    
+    # EndToEnd
+    for pattern in candidates['endtoend']:
+        match = pattern.search(text)
+        if match:
+            data['endtoend'] = match.group(1).strip()
+            logger.debug("🔢 EndToEnd: %s", data['endtoend'])
+            break
+    
+    # Data
+    for pattern in candidates['data']:
+        match = pattern.search(text)
+        if match:
+            date_str = match.group(1)
+            # Tentar converter para formato ISO
+            try:
+                if '/' in date_str:
+                    if date_str.count('/') == 2:
+                        parts = date_str.split('/')
+                        if len(parts[0]) == 4:  # YYYY/MM/DD
+                            data['date'] = date_str.replace('/', '-')
+                        else:  # DD/MM/YYYY
+                            data['date'] = f"{parts[2]}-{parts[1]}-{parts[0]}"
+                elif '-' in date_str:
+                    data['date'] = date_str
+                logger.debug("📅 Data: %s", data['date'])
+                break
+            except:
+                continue
+    
+    return data
+
+def _iter_page_texts(pdf_path: str, doc=None):
+    """Texto de cada página, extraído sob demanda.
+    Usa o documento PyMuPDF recebido (ou abre um), senão cai para o pdfplumber.
+    """
+    if doc is not None:
+        for page in doc:
+            yield page.get_text()
+    elif pymupdf is not None:
+        with pymupdf.open(pdf_path) as opened:
+            for page in opened:
+                yield page.get_text()
+    else:
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages:
+                yield page.extract_text() or ""
+
+def extract_from_pdf_text(pdf_path: str, doc=None) -> Dict:
     """
     Tenta extrair dados diretamente do texto do PDF
     Retorna None se não conseguir extrair informações suficientes
+    doc: documento PyMuPDF já aberto (opcional), para não reabrir o arquivo
     """
     if not PDF_TEXT_SUPPORT:
         return None
     
     try:
+        # Páginas são processadas sob demanda: comprovantes costumam estar na
+        # primeira página, então paramos assim que valor + chave PIX aparecem
+        # (a extração de texto da página é a etapa cara).
         text = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
+        data = None
+        for page_text in _iter_page_texts(pdf_path, doc):
+            text += page_text
+            if len(text) < 50:
+                continue
+            data = _try_extract(text)
+            if data.get('value') and data.get('receiver_pix_key'):
+                break
         
         if not text or len(text) < 50:
-            logger.warning(f"📄 PDF sem texto extraível ou muito curto")
+            logger.warning("📄 PDF sem texto extraível ou muito curto")
             return None
         
-        logger.info(f"📄 Texto extraído do PDF ({len(text)} caracteres)")
-        
-        # Extrair dados usando regex
-        data = {
-            'value': None,
-            'sender_pix_key': None,
-            'receiver_pix_key': None,
-            'beneficiary': None,
-            'endtoend': None,
-            'date': None,
-            'method': 'pdf_text'
-        }
-        
-        # Valor
-        for pattern in PATTERNS['valor']:
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                value_str = match.group(1).strip()
-                
-                # Lógica de conversão do formato brasileiro:
-                # 49.850,00 -> 49850.00 (valor com centavos)
-                # 49.850 -> 49850.00 (valor sem centavos)
-                # 49,85 -> 49.85 (valor pequeno com centavos)
-                
-                if ',' in value_str:
-                    # Tem vírgula = formato brasileiro com centavos
-                    # Remove pontos (separadores de milhar) e troca vírgula por ponto
-                    value_str = value_str.replace('.', '').replace(',', '.')
-                else:
-                    # Não tem vírgula, só ponto
-                    # Verificar se é separador de milhar ou decimal
-                    parts = value_str.split('.')
-                    if len(parts) == 2 and len(parts[1]) <= 2:
-                        # Tem ponto com 1-2 dígitos após = decimal (formato americano)
-                        # Ex: 49.85 -> manter como está
-                        pass
-                    else:
-                        # Tem ponto com 3+ dígitos = separador de milhar
-                        # Ex: 49.850 -> remover ponto
-                        value_str = value_str.replace('.', '')
-                
-                try:
-                    data['value'] = float(value_str)
-                    logger.info(f"💰 Valor encontrado: R$ {data['value']:.2f}")
-                    break
-                except Exception as e:
-                    logger.warning(f"⚠️ Erro ao converter valor '{value_str}': {e}")
-                    continue
-        
-        # PIX Remetente
-        for pattern in PATTERNS['pix_remetente']:
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                data['sender_pix_key'] = match.group(1).strip()
-                logger.info(f"👤 PIX Remetente encontrado: {data['sender_pix_key']}")
-                break
+        logger.debug("📄 Texto extraído do PDF (%d caracteres)", len(text))
         
         if not data['sender_pix_key']:
-            logger.warning(f"⚠️ PIX Remetente NÃO encontrado no texto")
-        
-        # PIX Destinatário
-        for pattern in PATTERNS['pix_destinatario']:
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                data['receiver_pix_key'] = match.group(1).strip()
-                logger.info(f"🎯 PIX Destinatário encontrado: {data['receiver_pix_key']}")
-                break
+            logger.warning("⚠️ PIX Remetente NÃO encontrado no texto")
         
         if not data['receiver_pix_key']:
-            logger.warning(f"⚠️ PIX Destinatário NÃO encontrado no texto")
-        
-        # Beneficiário
-        for pattern in PATTERNS['beneficiario']:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                data['beneficiary'] = match.group(1).strip()
-                logger.info(f"📝 Beneficiário: {data['beneficiary']}")
-                break
-        
-        # EndToEnd
-        for pattern in PATTERNS['endtoend']:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                data['endtoend'] = match.group(1).strip()
-                logger.info(f"🔢 EndToEnd: {data['endtoend']}")
-                break
-        
-        # Data
-        for pattern in PATTERNS['data']:
-            match = re.search(pattern, text)
-            if match:
-                date_str = match.group(1)
-                # Tentar converter para formato ISO
-                try:
-                    if '/' in date_str:
-                        if date_str.count('/') == 2:
-                            parts = date_str.split('/')
-                            if len(parts[0]) == 4:  # YYYY/MM/DD
-                                data['date'] = date_str.replace('/', '-')
-                            else:  # DD/MM/YYYY
-                                data['date'] = f"{parts[2]}-{parts[1]}-{parts[0]}"
-                    elif '-' in date_str:
-                        data['date'] = date_str
-                    logger.info(f"📅 Data: {data['date']}")
-                    break
-                except:
-                    continue
+            logger.warning("⚠️ PIX Destinatário NÃO encontrado no texto")
         
         # Validar se extraiu informações mínimas
         if data['value'] and data['value'] > 0:
-            logger.info(f"✅ Extração de PDF bem-sucedida (texto nativo)")
+            logger.info("✅ Extração de PDF bem-sucedida (texto nativo)")
             return {
                 **data,
                 'success': True,
@@ -205,11 +312,11 @@ def extract_from_pdf_text(pdf_path: str) -> Dict:
                 'error': None
             }
         else:
-            logger.warning(f"⚠️ Dados insuficientes extraídos do PDF")
+            logger.warning("⚠️ Dados insuficientes extraídos do PDF")
             return None
     
     except Exception as e:
-        logger.error(f"❌ Erro ao extrair texto do PDF: {e}")
+        logger.error("❌ Erro ao extrair texto do PDF: %s", e)
         return None
 
 def should_use_pdf_extractor(file_path: str) -> bool:
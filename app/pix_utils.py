@@ -3,6 +3,12 @@ PIX utilities: normalization helpers used across the backend.
 """
 import re
 
+# 'pix:' / 'pix ' prefix or a bare 'pix' (does not strip 'pix' from 'pixel@...')
+_PIX_PREFIX = re.compile(r'^pix(?:[: ]|\Z)')
+# spaces (all unicode whitespace, like re's \s), hyphens, dots, slashes,
+# parentheses, colons and backslashes
+_PIX_STRIP = str.maketrans('', '', '-./():\\' + ''.join(c for c in map(chr, range(0x3001)) if c.isspace()))
+
 def normalize_pix_key(pix: str) -> str:
     """Normalize a PIX key for consistent comparison.
     Removes whitespace and common punctuation, lowercases, and returns an empty
@@ -12,12 +18,5 @@ def normalize_pix_key(pix: str) -> str:
         return ""
     s = str(pix).strip().lower()
     # remover prefixo 'pix' ou 'pix:' se presente
-    if s.startswith('pix:'):
-        s = s[4:].strip()
-    elif s.startswith('pix '):
-        s = s[4:].strip()
-    elif s == 'pix':
-        s = ''
-    # remove spaces, hyphens, dots, slashes, parentheses, colons and backslashes
-    s = re.sub(r"[\s\-\./():\\]+", "", s)
-    return s
+    s = _PIX_PREFIX.sub('', s, count=1)
+    return s.translate(_PIX_STRIP)
@@ -0,0 +1,255 @@
+"""
+Cliente HTTP compartilhado da API do Telegram.
+Usado pelo bot de polling (telegram_bot_simple) e pelo webhook (telegram_webhook):
+uma única Session com pool de conexões, JSON via orjson e helpers de envio/download.
+"""
+import atexit
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+# Filho de 'telegram_bot': no bot de polling cai nos mesmos handlers (bot.log + stdout)
+logger = logging.getLogger('telegram_bot.api')
+
+load_dotenv()
+
+# Read token from environment (do not hardcode in source)
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+if TELEGRAM_TOKEN:
+    TELEGRAM_API = f'https://api.telegram.org/bot{TELEGRAM_TOKEN}'
+    TELEGRAM_FILE_API = f'https://api.telegram.org/file/bot{TELEGRAM_TOKEN}'
+else:
+    TELEGRAM_API = TELEGRAM_FILE_API = None
+    logger.warning('TELEGRAM_TOKEN not set in environment; Telegram API calls will fail until token is provided')
+
+# ============================================================================
+# HTTP SESSION & JSON
+# ============================================================================
+
+# Persistent session for Telegram API and uploads: keep-alive instead of a new TCP/TLS handshake per call.
+# Retry only covers idempotent methods (urllib3 default), so POSTs are never resent.
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                          max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_SESSION = _make_session()
+atexit.register(_SESSION.close)
+
+# getUpdates em sessão própria, sem retry no adapter: 429/5xx chegam ao loop de polling
+# (RetryAfter/backoff) em vez de serem absorvidos pelo urllib3, qualquer que seja o método
+_POLL_SESSION = requests.Session()
+_POLL_SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+_POLL_SESSION.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+atexit.register(_POLL_SESSION.close)
+
+# JSON via orjson quando disponível (encode/decode em C); stdlib como fallback
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+def json_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
+
+def json_loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def post_json(url: str, payload: Dict, timeout) -> requests.Response:
+    return _SESSION.post(url, data=json_dumps(payload), headers=JSON_HEADERS, timeout=timeout)
+
+def request_updates(payload: Dict, timeout) -> requests.Response:
+    """Raw getUpdates call on the no-retry polling session."""
+    return _POLL_SESSION.post(f'{TELEGRAM_API}/getUpdates', data=json_dumps(payload), headers=JSON_HEADERS, timeout=timeout)
+
+_CONTENT_TYPES = {'.pdf': 'application/pdf', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png'}
+
+def guess_content_type(filename: str) -> str:
+    """Multipart content type from file extension."""
+    return _CONTENT_TYPES.get(Path(filename).suffix.lower(), 'application/octet-stream')
+
+def post_multipart(url: str, data: Dict[str, Any], files: List[Tuple[str, Tuple]], timeout) -> requests.Response:
+    """POST multipart form; streamed chunk by chunk with requests-toolbelt when installed."""
+    if MultipartEncoder is None:
+        return _SESSION.post(url, files=files, data=data, timeout=timeout)
+    # Campos None são omitidos, como o requests faz em data=
+    fields = [(k, v) for k, v in data.items() if v is not None]
+    for name, (fname, content, ctype) in files:
+        # toolbelt só aceita bytes/arquivo: bytearray (download_file) vira BytesIO
+        fields.append((name, (fname, content if isinstance(content, bytes) else io.BytesIO(content), ctype)))
+    enc = MultipartEncoder(fields=fields)
+    return _SESSION.post(url, data=enc, headers={'Content-Type': enc.content_type}, timeout=timeout)
+
+# ============================================================================
+# TELEGRAM HELPERS
+# ============================================================================
+
+def get_me(timeout: float = 5) -> Optional[Dict]:
+    """Bot info (getMe) or None."""
+    resp = _SESSION.get(f'{TELEGRAM_API}/getMe', timeout=timeout)
+    if resp.status_code != 200:
+        return None
+    data = json_loads(resp.content)
+    return data.get('result') if data.get('ok') else None
+
+def set_webhook(url: str, secret_token: Optional[str] = None, max_connections: int = 40) -> bool:
+    """Register webhook URL (Telegram pushes updates; getUpdates stops working while set)."""
+    payload = {'url': url, 'allowed_updates': ['message'], 'max_connections': max_connections}
+    if secret_token:
+        payload['secret_token'] = secret_token
+    try:
+        resp = post_json(f'{TELEGRAM_API}/setWebhook', payload, timeout=10)
+        ok = resp.status_code == 200 and json_loads(resp.content).get('ok', False)
+        if not ok:
+            logger.error('❌ setWebhook failed: status=%s, response=%s', resp.status_code, resp.text[:200])
+        return ok
+    except Exception as e:
+        logger.error('setWebhook error: %s', e)
+        return False
+
+def send_message(chat_id: int, text: str, parse_mode: str = 'Markdown') -> Optional[Dict]:
+    """Send text message."""
+    try:
+        resp = post_json(
+            f'{TELEGRAM_API}/sendMessage',
+            {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode},
+            timeout=10
+        )
+        return json_loads(resp.content) if resp.status_code == 200 else None
+    except Exception as e:
+        logger.error('send_message error: %s', e)
+        return None
+
+def reply_to_message(chat_id: int, message_id: int, text: str, parse_mode: str = 'Markdown') -> Optional[Dict]:
+    """Send reply to a message."""
+    try:
+        logger.debug('📤 Sending reply to message %s in chat %s', message_id, chat_id)
+        resp = post_json(
+            f'{TELEGRAM_API}/sendMessage',
+            {'chat_id': chat_id, 'reply_to_message_id': message_id, 'text': text, 'parse_mode': parse_mode},
+            timeout=10
+        )
+        if resp.status_code == 200:
+            logger.info('✅ Reply sent: %s...', text[:50])
+            return json_loads(resp.content)
+        else:
+            logger.error('❌ Failed to send reply: status=%s, response=%s', resp.status_code, resp.text[:100])
+            return None
+    except Exception as e:
+        logger.error('reply_to_message error: %s', e)
+        return None
+
+# Formato aceito pelo setMessageReaction ('dict' = lista ReactionTypeEmoji, 'string' = emoji puro).
+# Descoberto no primeiro 400 e mantido: evita repetir o round-trip do fallback em toda reação.
+_REACTION_FORMAT = 'dict'
+
+def _reaction_payload(chat_id: int, message_id: int, emoji: str, fmt: str) -> Dict:
+    reaction = [{'type': 'emoji', 'emoji': emoji}] if fmt == 'dict' else emoji
+    return {'chat_id': chat_id, 'message_id': message_id, 'reaction': reaction}
+
+def set_reaction(chat_id: int, message_id: int, emoji: str = '👍') -> bool:
+    """Set reaction emoji on message."""
+    global _REACTION_FORMAT
+    try:
+        fmt = _REACTION_FORMAT
+        resp = post_json(f'{TELEGRAM_API}/setMessageReaction', _reaction_payload(chat_id, message_id, emoji, fmt), timeout=10)
+        if resp.status_code == 400:
+            # Fallback: try the other payload shape; remember it if it works
+            other = 'string' if fmt == 'dict' else 'dict'
+            resp = post_json(f'{TELEGRAM_API}/setMessageReaction', _reaction_payload(chat_id, message_id, emoji, other), timeout=10)
+            if resp.status_code == 200:
+                logger.info('setMessageReaction: switching to %s payload', other)
+                _REACTION_FORMAT = other
+        return resp.status_code == 200
+    except Exception as e:
+        logger.debug('set_reaction error: %s', e)
+        return False
+
+# getFile: file_path é válido por pelo menos 1h; reusa em reenvios/retries
+FILE_PATH_TTL = 3000  # seconds
+FILE_PATH_CACHE_MAX = 512
+_file_path_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_file_path_lock = threading.Lock()
+
+def _get_file_path(file_id: str) -> Optional[str]:
+    """Resolve file_id to Telegram file_path (cached)."""
+    now = time.monotonic()
+    with _file_path_lock:
+        entry = _file_path_cache.get(file_id)
+        if entry and entry[0] > now:
+            _file_path_cache.move_to_end(file_id)
+            return entry[1]
+    
+    resp = _SESSION.get(f'{TELEGRAM_API}/getFile', params={'file_id': file_id}, timeout=10)
+    if resp.status_code != 200:
+        return None
+    
+    file_info = json_loads(resp.content)
+    if not file_info.get('ok'):
+        return None
+    
+    file_path = file_info['result']['file_path']
+    with _file_path_lock:
+        _file_path_cache[file_id] = (now + FILE_PATH_TTL, file_path)
+        _file_path_cache.move_to_end(file_id)
+        while len(_file_path_cache) > FILE_PATH_CACHE_MAX:
+            _file_path_cache.popitem(last=False)
+    return file_path
+
+def _read_body(resp: requests.Response) -> Optional[bytearray]:
+    """Read streamed body straight into a buffer sized by Content-Length."""
+    size = int(resp.headers.get('Content-Length') or 0)
+    if not size or resp.headers.get('Content-Encoding'):
+        return bytearray(resp.content)
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        n = resp.raw.readinto(view[pos:])
+        if not n:
+            break
+        pos += n
+    if pos != size:
+        logger.error('download_file truncated: %s/%s bytes', pos, size)
+        return None
+    return buf
+
+def download_file(file_id: str) -> Optional[bytearray]:
+    """Download file from Telegram (bytearray: filled in place, not copied to bytes)."""
+    try:
+        file_path = _get_file_path(file_id)
+        if not file_path:
+            return None
+    
+        file_url = f'{TELEGRAM_FILE_API}/{file_path}'
+        with _SESSION.get(file_url, stream=True, timeout=30) as file_resp:
+            if file_resp.status_code != 200:
+                # file_path expirado: força novo getFile na próxima tentativa
+                with _file_path_lock:
+                    _file_path_cache.pop(file_id, None)
+                return None
+            return _read_body(file_resp)
+    except Exception as e:
+        logger.error('download_file error: %s', e)
+        return None
@@ -6,25 +6,38 @@ reactions, media groups, logging robusto e suporte a backend de produção.
 Ambiente:
   TELEGRAM_TOKEN: token do bot (obrigatório)
   BACKEND_URL: URL do backend (padrão: https://new-bot-nader-production.up.railway.app)
-  OPENAI_API_KEY: opcional, para OCR via OpenAI
+  OCR_LANG: idioma do tesseract para o fingerprint OCR (padrão: por)
   PHASH_THRESHOLD: distância máxima de pHash para duplicata (padrão: 5)
+  LOG_LEVEL: nível de log do bot, arquivo e console (padrão: INFO)
 """
 
 import os
 import sys
+import atexit
+import signal
 import logging
+import re
 import requests
-import json
+import httpx
 import time
 import io
 import threading
 import hashlib
-import base64
-import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from types import MappingProxyType
 from dotenv import load_dotenv
 from typing import Optional, Tuple, Dict, List, Any
 
+# Telegram HTTP client shared with the webhook (Session, JSON, send/reaction/download)
+try:
+    from .telegram_api import (JSON_HEADERS, json_dumps, json_loads, post_multipart, guess_content_type, get_me,
+                               request_updates, send_message, reply_to_message, set_reaction, download_file)
+except ImportError:
+    from telegram_api import (JSON_HEADERS, json_dumps, json_loads, post_multipart, guess_content_type, get_me,
+                              request_updates, send_message, reply_to_message, set_reaction, download_file)
+
 # Optional libraries
 try:
     from PIL import Image
@@ -36,11 +49,22 @@ try:
 except ImportError:
     imagehash = None
 
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
 try:
     import pytesseract
 except ImportError:
     pytesseract = None
 
+try:
+    from pybloom_live import ScalableBloomFilter
+except ImportError:
+    ScalableBloomFilter = None
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
@@ -51,13 +75,27 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 BACKEND_URL = os.getenv('BACKEND_URL', 'https://new-bot-nader-production.up.railway.app')
 PHASH_THRESHOLD = int(os.getenv('PHASH_THRESHOLD', '5'))
 BOT_LOG_FILE = Path(__file__).parent / 'bot.log'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+SEEN_BLOOM_FILE = Path(__file__).parent / 'seen_sha256.bloom'
+OCR_LANG = os.getenv('OCR_LANG', 'por')
+OCR_MAX_DIM = 1024
+OCR_TIMEOUT = 10  # seconds, caps worst-case tesseract run
 
 # Validate token early
 if not TELEGRAM_TOKEN:
     print('ERROR: TELEGRAM_TOKEN not set in environment. Exiting.')
     sys.exit(1)
 
-TELEGRAM_API = f'https://api.telegram.org/bot{TELEGRAM_TOKEN}'
+# Persistent client for backend dedup calls: reuses TCP/TLS (and HTTP/2 when h2 is installed)
+def _make_backend_client() -> httpx.Client:
+    kwargs = dict(base_url=BACKEND_URL, timeout=10.0, limits=httpx.Limits(max_keepalive_connections=8))
+    try:
+        return httpx.Client(http2=True, **kwargs)
+    except ImportError:
+        return httpx.Client(**kwargs)
+
+_backend = _make_backend_client()
+atexit.register(_backend.close)
 
 # ============================================================================
 # LOGGING
@@ -66,7 +104,10 @@ TELEGRAM_API = f'https://api.telegram.org/bot{TELEGRAM_TOKEN}'
 def setup_logging():
     """Configure logging to file and console with timestamps."""
     logger = logging.getLogger('telegram_bot')
-    logger.setLevel(logging.DEBUG)
+    level = logging.getLevelName(LOG_LEVEL)
+    if not isinstance(level, int):
+        level = logging.INFO  # unknown LOG_LEVEL
+    logger.setLevel(level)
     
     # Remove existing handlers
     for handler in logger.handlers[:]:
@@ -74,11 +115,11 @@ def setup_logging():
     
     # File handler
     fh = logging.FileHandler(str(BOT_LOG_FILE), encoding='utf-8')
-    fh.setLevel(logging.DEBUG)
+    fh.setLevel(level)
     
     # Console handler - write to stdout immediately
     ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.DEBUG)
+    ch.setLevel(level)
     ch.flush = lambda: sys.stdout.flush()  # Force flush after each log
     
     # Formatter
@@ -100,103 +141,233 @@ logger = setup_logging()
 # DUPLICATE DETECTION (Backend-only, no local SQLite)
 # ============================================================================
 
+# Same set as str.isalnum(): everything that is not a letter/digit (incl. '_')
+_NON_ALNUM = re.compile(r'[\W_]+')
+
 def compute_sha256(file_bytes: bytes) -> str:
     """Compute SHA256 hash of file."""
     return hashlib.sha256(file_bytes).hexdigest()
 
+def _phash_cv2(small: "Image.Image") -> str:
+    """DCT step of imagehash.phash (hash_size=8) via OpenCV, on the already-resized 32x32 grayscale image."""
+    low = cv2.dct(np.asarray(small, dtype=np.float64))[:8, :8]
+    # cv2.dct is orthonormal; rescale row/col 0 to match scipy's unnormalized DCT-II
+    low[0, :] *= np.sqrt(2)
+    low[:, 0] *= np.sqrt(2)
+    bits = (low > np.median(low)).flatten()
+    return format(int(''.join('1' if b else '0' for b in bits), 2), '016x')
+
 def compute_phash(file_bytes: bytes) -> Optional[str]:
-    """Compute perceptual hash using imagehash (if available)."""
-    if not imagehash or not Image:
+    """Compute perceptual hash (imagehash.phash format), DCT via OpenCV when available."""
+    if not Image or (cv2 is None and not imagehash):
         return None
     try:
         with Image.open(io.BytesIO(file_bytes)) as img:
-            ph = imagehash.phash(img)
-            return str(ph)
+            if cv2 is None:
+                return str(imagehash.phash(img))
+            # Same decode + LANCZOS resize as imagehash: hashes stay comparable with stored ones
+            return _phash_cv2(img.convert('L').resize((32, 32), Image.LANCZOS))
     except Exception as e:
-        logger.debug(f'phash error: {e}')
+        logger.debug('phash error: %s', e)
         return None
 
 def compute_ocr_fingerprint(file_bytes: bytes) -> Optional[str]:
-    """Extract text via OpenAI OCR (if key set) or pytesseract; return SHA256 of normalized text."""
-    # Try OpenAI if configured
-    openai_key = os.getenv('OPENAI_API_KEY')
-    if openai_key:
-        try:
-            b64 = base64.b64encode(file_bytes).decode('ascii')
-            payload = {
-                'model': 'gpt-4o-mini-vision',
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': [
-                            {'type': 'text', 'text': 'Extract all text from the image. Return only plain text.'},
-                            {'type': 'image_url', 'image_url': {'url': f'data:image;base64,{b64}'}}
-                        ]
-                    }
-                ]
-            }
-            headers = {'Authorization': f'Bearer {openai_key}', 'Content-Type': 'application/json'}
-            resp = requests.post('https://api.openai.com/v1/chat/completions', headers=headers, json=payload, timeout=60)
-            if resp.status_code == 200:
-                j = resp.json()
-                text = ''
-                for choice in j.get('choices', []):
-                    if choice.get('message', {}).get('content'):
-                        text += choice['message']['content']
-                if text:
-                    norm = ''.join(ch for ch in text.lower() if ch.isalnum())
-                    return hashlib.sha256(norm.encode('utf-8')).hexdigest()
-        except Exception as e:
-            logger.debug(f'OpenAI OCR failed: {e}')
-    
-    # Fallback to pytesseract
-    if pytesseract and Image:
-        try:
-            with Image.open(io.BytesIO(file_bytes)) as img:
-                text = pytesseract.image_to_string(img)
-                if text:
-                    norm = ''.join(ch for ch in text.lower() if ch.isalnum())
-                    return hashlib.sha256(norm.encode('utf-8')).hexdigest()
-        except Exception as e:
-            logger.debug(f'pytesseract OCR failed: {e}')
+    """Extract text via local pytesseract; return SHA256 of normalized text."""
+    if not pytesseract or not Image:
+        return None
+    try:
+        with Image.open(io.BytesIO(file_bytes)) as img:
+            # Grayscale + downscale: much faster OCR, enough for a fingerprint
+            gray = img.convert('L')
+            if max(gray.size) > OCR_MAX_DIM:
+                gray.thumbnail((OCR_MAX_DIM, OCR_MAX_DIM), Image.LANCZOS)
+            text = pytesseract.image_to_string(gray, lang=OCR_LANG, config='--psm 6 --oem 1', timeout=OCR_TIMEOUT)
+            if text:
+                norm = _NON_ALNUM.sub('', text.lower())
+                return hashlib.sha256(norm.encode('utf-8')).hexdigest()
+    except Exception as e:
+        logger.debug('pytesseract OCR failed: %s', e)
     
     return None
 
-def is_duplicate_and_record(file_bytes: bytes, user_id: int = None, user_name: str = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
-    """
-    Check duplicates via backend (PostgreSQL 24/7).
-    No local SQLite cache - backend is authoritative and always available.
-    Returns (is_dup, reason_dict) with original user info if duplicate found.
-    """
-    sha = compute_sha256(file_bytes)
-    
-    # Check backend first (single source of truth)
+# Shared pool for fingerprint computation (pHash/OCR) off the calling thread
+_FP_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='fingerprint')
+
+# (pHash, OCR) per SHA256: resends and the upload right after the duplicate check don't recompute
+FP_CACHE_MAX = 2048
+_FP_CACHE: "OrderedDict[str, Tuple[Optional[str], Optional[str]]]" = OrderedDict()
+_fp_cache_lock = threading.Lock()
+
+def _fp_cache_get(sha: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """Return cached (phash, ocr_hash) for sha."""
+    with _fp_cache_lock:
+        hit = _FP_CACHE.get(sha)
+        if hit is not None:
+            _FP_CACHE.move_to_end(sha)
+        return hit
+
+def _fp_cache_set(sha: str, phash: Optional[str], ocr_hash: Optional[str]):
+    with _fp_cache_lock:
+        _FP_CACHE[sha] = (phash, ocr_hash)
+        _FP_CACHE.move_to_end(sha)
+        while len(_FP_CACHE) > FP_CACHE_MAX:
+            _FP_CACHE.popitem(last=False)
+
+# Local cache of check-duplicate results (avoids repeated GETs in bursts/media groups)
+DUP_CACHE_MAX = 4096
+DUP_CACHE_TTL = 60      # seconds for positive results (duplicate)
+DUP_CACHE_NEG_TTL = 5   # seconds for negative results
+_dup_cache: "OrderedDict[str, Tuple[float, Tuple[bool, Optional[Dict[str, Any]]]]]" = OrderedDict()
+_dup_cache_lock = threading.Lock()
+
+def _dup_cache_get(sha: str) -> Optional[Tuple[bool, Optional[Dict[str, Any]]]]:
+    """Return cached (is_dup, info) for sha if still fresh."""
+    with _dup_cache_lock:
+        hit = _dup_cache.get(sha)
+        if not hit:
+            return None
+        ts, result = hit
+        ttl = DUP_CACHE_TTL if result[0] else DUP_CACHE_NEG_TTL
+        if time.time() - ts >= ttl:
+            del _dup_cache[sha]
+            return None
+        _dup_cache.move_to_end(sha)
+        return result
+
+def _dup_cache_set(sha: str, result: Tuple[bool, Optional[Dict[str, Any]]]):
+    """Store result for sha, evicting least recently used entries."""
+    with _dup_cache_lock:
+        _dup_cache[sha] = (time.time(), result)
+        _dup_cache.move_to_end(sha)
+        while len(_dup_cache) > DUP_CACHE_MAX:
+            _dup_cache.popitem(last=False)
+
+# Bloom filter of SHA256s known to the backend (recorded or reported as duplicate).
+# Only a hint ("maybe seen"): lets us skip pHash/OCR precompute for likely repeats,
+# never decides that a file is a duplicate. Persisted across restarts.
+SEEN_SAVE_EVERY = 100  # new SHAs between saves
+_seen_lock = threading.Lock()
+_seen_unsaved = 0
+
+def _load_seen_bloom():
+    if ScalableBloomFilter is None:
+        return None
+    try:
+        if SEEN_BLOOM_FILE.exists():
+            with open(SEEN_BLOOM_FILE, 'rb') as f:
+                return ScalableBloomFilter.fromfile(f)
+    except Exception as e:
+        logger.warning('⚠️ Could not load %s, starting empty: %s', SEEN_BLOOM_FILE.name, e)
+    return ScalableBloomFilter(initial_capacity=10_000, error_rate=0.001)
+
+def _save_seen_bloom():
+    """Write the filter to a temp file and swap it in, so a kill mid-write keeps the old file."""
+    global _seen_unsaved
+    if _seen is None:
+        return
+    tmp = SEEN_BLOOM_FILE.with_name(SEEN_BLOOM_FILE.name + '.tmp')
+    try:
+        with _seen_lock:
+            with open(tmp, 'wb') as f:
+                _seen.tofile(f)
+            os.replace(tmp, SEEN_BLOOM_FILE)
+            _seen_unsaved = 0
+    except Exception as e:
+        logger.warning('⚠️ Could not save %s: %s', SEEN_BLOOM_FILE.name, e)
+
+_seen = _load_seen_bloom()
+atexit.register(_save_seen_bloom)
+
+def _seen_add(sha: str):
+    global _seen_unsaved
+    if _seen is None:
+        return
+    with _seen_lock:
+        # add() returns True if the key was already in the filter
+        if not _seen.add(sha):
+            _seen_unsaved += 1
+        due = _seen_unsaved >= SEEN_SAVE_EVERY
+    # Periodic save: a SIGKILL restart loses at most SEEN_SAVE_EVERY entries
+    if due:
+        _save_seen_bloom()
+
+def _seen_contains(sha: str) -> bool:
+    if _seen is None:
+        return False
+    with _seen_lock:
+        return sha in _seen
+
+def _backend_check(sha: str) -> Optional[Tuple[bool, Optional[Dict[str, Any]]]]:
+    """Ask backend whether sha was already seen. Returns None if the check failed."""
     try:
-        logger.debug(f'🔍 [BACKEND] Checking for duplicate: {sha[:16]}...')
-        resp = requests.get(
-            f'{BACKEND_URL}/telegram/check-duplicate/{sha}',
-            timeout=10
-        )
+        logger.debug('🔍 [BACKEND] Checking for duplicate: %s...', sha[:16])
+        resp = _backend.get(f'/telegram/check-duplicate/{sha}')
         if resp.status_code == 200:
-            data = resp.json()
+            data = json_loads(resp.content)
             if data.get('is_duplicate'):
                 original = data.get('original', {})
-                logger.info(f'🔁 [BACKEND] Duplicate found: {original.get("user_name")} (ID: {original.get("user_id")})')
+                logger.info('🔁 [BACKEND] Duplicate found: %s (ID: %s)', original.get("user_name"), original.get("user_id"))
                 return True, {
                     'method': data.get('method', 'sha256'),
                     'original_user_id': original.get('user_id'),
                     'original_user_name': original.get('user_name')
                 }
-        logger.debug(f'✅ [BACKEND] No duplicate found')
+            logger.debug('✅ [BACKEND] No duplicate found')
+            return False, None
+        logger.debug('⚠️ [BACKEND] Duplicate check returned %s', resp.status_code)
     except Exception as e:
-        logger.error(f'❌ [BACKEND CHECK FAILED] {e}')
-        # Don't block - continue to record anyway
+        logger.error('❌ [BACKEND CHECK FAILED] %s', e)
+    return None
+
+def _cached_dup(sha: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """Duplicate check with local TTL cache in front of the backend."""
+    hit = _dup_cache_get(sha)
+    if hit is not None:
+        logger.debug('⚡ [CACHE] Duplicate check hit: %s...', sha[:16])
+        return hit
+    
+    result = _backend_check(sha)
+    if result is None:
+        # Don't block (or cache) on backend failure - continue to record anyway
+        return False, None
+    if result[0]:
+        _seen_add(sha)
+    _dup_cache_set(sha, result)
+    return result
+
+def is_duplicate_and_record(file_bytes: bytes, user_id: int = None, user_name: str = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Check duplicates via backend (PostgreSQL 24/7).
+    Backend is authoritative; a short-lived local cache only absorbs repeated
+    checks of the same SHA256 (media groups, retries).
+    Returns (is_dup, reason_dict) with original user info if duplicate found.
+    """
+    sha = compute_sha256(file_bytes)
+    
+    # pHash/OCR run in the pool while this thread waits on the backend check,
+    # unless the bloom says this SHA is almost certainly a repeat
+    phash_fut = ocr_fut = None
+    cached_fp = _fp_cache_get(sha)
+    if cached_fp is None and not _seen_contains(sha):
+        phash_fut = _FP_POOL.submit(compute_phash, file_bytes)
+        ocr_fut = _FP_POOL.submit(compute_ocr_fingerprint, file_bytes)
+    
+    is_dup, dup_info = _cached_dup(sha)
+    if is_dup:
+        if phash_fut:
+            phash_fut.cancel()
+            ocr_fut.cancel()
+        return True, dup_info
     
     # Record fingerprint to backend (for future duplicate detection)
     try:
-        logger.debug(f'📤 [BACKEND] Recording new fingerprint...')
-        ocr_hash = compute_ocr_fingerprint(file_bytes)
-        phash = compute_phash(file_bytes)
+        logger.debug('📤 [BACKEND] Recording new fingerprint...')
+        if cached_fp is not None:
+            phash, ocr_hash = cached_fp
+        else:
+            ocr_hash = ocr_fut.result() if ocr_fut else compute_ocr_fingerprint(file_bytes)
+            phash = phash_fut.result() if phash_fut else compute_phash(file_bytes)
+            _fp_cache_set(sha, phash, ocr_hash)
         
         payload = {
             'sha256': sha,
@@ -207,117 +378,65 @@ def is_duplicate_and_record(file_bytes: bytes, user_id: int = None, user_name: s
             'timestamp': int(time.time())
         }
         
-        resp = requests.post(
-            f'{BACKEND_URL}/telegram/record-fingerprint',
-            json=payload,
-            timeout=10
-        )
+        resp = _backend.post('/telegram/record-fingerprint', content=json_dumps(payload), headers=JSON_HEADERS)
         if resp.status_code == 201:
-            logger.debug(f'✅ [BACKEND] Fingerprint recorded successfully')
+            logger.debug('✅ [BACKEND] Fingerprint recorded successfully')
+            _seen_add(sha)
+            # Same file arriving again shortly (e.g. same media group) is now a duplicate
+            _dup_cache_set(sha, (True, {
+                'method': 'sha256',
+                'original_user_id': user_id,
+                'original_user_name': user_name
+            }))
         else:
-            logger.debug(f'⚠️ [BACKEND] Fingerprint record returned {resp.status_code}')
+            logger.debug('⚠️ [BACKEND] Fingerprint record returned %s', resp.status_code)
     except Exception as e:
-        logger.debug(f'⚠️ [BACKEND RECORD FAILED] {e}')
+        logger.debug('⚠️ [BACKEND RECORD FAILED] %s', e)
     
     return False, None
 
 # ============================================================================
-# TELEGRAM HELPERS
+# UPLOAD HELPERS
 # ============================================================================
 
-def send_message(chat_id: int, text: str, parse_mode: str = 'Markdown') -> Optional[Dict]:
-    """Send text message."""
-    try:
-        resp = requests.post(
-            f'{TELEGRAM_API}/sendMessage',
-            json={'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode},
-            timeout=10
-        )
-        return resp.json() if resp.status_code == 200 else None
-    except Exception as e:
-        logger.error(f'send_message error: {e}')
-        return None
-
-def reply_to_message(chat_id: int, message_id: int, text: str, parse_mode: str = 'Markdown') -> Optional[Dict]:
-    """Send reply to a message."""
+def _safe_call(func, *args) -> Any:
     try:
-        logger.debug(f'📤 Sending reply to message {message_id} in chat {chat_id}')
-        resp = requests.post(
-            f'{TELEGRAM_API}/sendMessage',
-            json={'chat_id': chat_id, 'reply_to_message_id': message_id, 'text': text, 'parse_mode': parse_mode},
-            timeout=10
-        )
-        if resp.status_code == 200:
-            logger.info(f'✅ Reply sent: {text[:50]}...')
-            return resp.json()
-        else:
-            logger.error(f'❌ Failed to send reply: status={resp.status_code}, response={resp.text[:100]}')
-            return None
-    except Exception as e:
-        logger.error(f'reply_to_message error: {e}')
+        return func(*args)
+    except Exception:
         return None
 
-def set_reaction(chat_id: int, message_id: int, emoji: str = '👍') -> bool:
-    """Set reaction emoji on message."""
-    try:
-        payload = {
-            'chat_id': chat_id,
-            'message_id': message_id,
-            'reaction': [{'type': 'emoji', 'emoji': emoji}]
-        }
-        resp = requests.post(f'{TELEGRAM_API}/setMessageReaction', json=payload, timeout=10)
-        if resp.status_code == 400:
-            # Fallback: try simple string
-            payload['reaction'] = emoji
-            resp = requests.post(f'{TELEGRAM_API}/setMessageReaction', json=payload, timeout=10)
-        return resp.status_code == 200
-    except Exception as e:
-        logger.debug(f'set_reaction error: {e}')
-        return False
-
-def download_file(file_id: str) -> Optional[bytes]:
-    """Download file from Telegram."""
+def _safe_result(fut: Future) -> Any:
+    """Future result, or None if the computation raised."""
     try:
-        resp = requests.get(f'{TELEGRAM_API}/getFile', params={'file_id': file_id}, timeout=10)
-        if resp.status_code != 200:
-            return None
-        
-        file_info = resp.json()
-        if not file_info.get('ok'):
-            return None
-        
-        file_path = file_info['result']['file_path']
-        file_url = f'https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}'
-        file_resp = requests.get(file_url, timeout=30)
-        return file_resp.content if file_resp.status_code == 200 else None
-    except Exception as e:
-        logger.error(f'download_file error: {e}')
+        return fut.result()
+    except Exception:
         return None
 
-# ============================================================================
-# UPLOAD HELPERS
-# ============================================================================
+def _fingerprints(blobs: List[bytes]) -> List[Tuple[Optional[str], Optional[str], Optional[str]]]:
+    """(sha256, phash, ocr_hash) per file; cache misses are all submitted to the pool upfront."""
+    shas = [_safe_call(compute_sha256, fb) for fb in blobs]
+    cached = [_fp_cache_get(sha) if sha else None for sha in shas]
+    futures = [None if hit is not None else (_FP_POOL.submit(compute_phash, fb), _FP_POOL.submit(compute_ocr_fingerprint, fb))
+               for fb, hit in zip(blobs, cached)]
+    
+    results = []
+    for sha, hit, futs in zip(shas, cached, futures):
+        if hit is None:
+            hit = (_safe_result(futs[0]), _safe_result(futs[1]))
+            if sha:
+                _fp_cache_set(sha, *hit)
+        results.append((sha, *hit))
+    return results
 
 def upload_to_backend(file_bytes: bytes, filename: str, user_id: int, user_name: str) -> Dict[str, Any]:
     """Upload file to backend with fingerprints."""
     try:
-        logger.info(f'[UPLOAD] {filename} ({len(file_bytes)} bytes) for user_id={user_id}')
+        logger.info('[UPLOAD] %s (%s bytes) for user_id=%s', filename, len(file_bytes), user_id)
         
-        # Compute fingerprints
-        try:
-            sha = compute_sha256(file_bytes)
-        except Exception:
-            sha = None
-        try:
-            ocr = compute_ocr_fingerprint(file_bytes)
-        except Exception:
-            ocr = None
-        try:
-            ph = compute_phash(file_bytes)
-        except Exception:
-            ph = None
+        # Compute fingerprints: SHA first (cheap); pHash/OCR from cache or in parallel on the pool
+        sha, ph, ocr = _fingerprints([file_bytes])[0]
         
-        files = {'files': (filename, io.BytesIO(file_bytes))}
+        files = [('files', (filename, file_bytes, guess_content_type(filename)))]
         data = {
             'telegram_user_id': str(user_id),
             'telegram_user_name': user_name,
@@ -326,122 +445,197 @@ def upload_to_backend(file_bytes: bytes, filename: str, user_id: int, user_name:
             'phash': ph
         }
         
-        resp = requests.post(f'{BACKEND_URL}/telegram/upload', files=files, data=data, timeout=120)
-        logger.info(f'[UPLOAD] response status={resp.status_code}')
+        resp = post_multipart(f'{BACKEND_URL}/telegram/upload', data, files, timeout=120)
+        logger.info('[UPLOAD] response status=%s', resp.status_code)
         
-        result = resp.json() if resp.status_code == 200 else {'success': False, 'error': resp.text}
+        result = json_loads(resp.content) if resp.status_code == 200 else {'success': False, 'error': resp.text}
         if isinstance(result, list) and len(result) == 2:
             result = result[0]
         
-        logger.debug(f'[UPLOAD] result: {str(result)[:200]}')
+        logger.debug('[UPLOAD] result: %s', str(result)[:200])
         return result
     except Exception as e:
-        logger.error(f'[UPLOAD] error: {e}\n{traceback.format_exc()}')
+        logger.error('[UPLOAD] error: %s', e, exc_info=True)
         return {'success': False, 'error': str(e)}
 
 def upload_multiple_to_backend(files_list: List[Tuple[bytes, str]], user_id: int, user_name: str) -> Dict[str, Any]:
     """Upload multiple files in one request."""
     try:
-        logger.info(f'[UPLOAD_MULTIPLE] {len(files_list)} files for user_id={user_id}')
+        logger.info('[UPLOAD_MULTIPLE] %s files for user_id=%s', len(files_list), user_id)
         
-        files = []
-        sha256s, ocr_hashes, phashes = [], [], []
+        files = [('files', (fname, fb, guess_content_type(fname))) for fb, fname in files_list]
         
-        for fb, fname in files_list:
-            files.append(('files', (fname, io.BytesIO(fb))))
-            try:
-                sha256s.append(compute_sha256(fb))
-            except Exception:
-                sha256s.append(None)
-            try:
-                ocr_hashes.append(compute_ocr_fingerprint(fb))
-            except Exception:
-                ocr_hashes.append(None)
-            try:
-                phashes.append(compute_phash(fb))
-            except Exception:
-                phashes.append(None)
+        fps = _fingerprints([fb for fb, _ in files_list])
+        sha256s = [sha for sha, _, _ in fps]
+        phashes = [ph for _, ph, _ in fps]
+        ocr_hashes = [ocr for _, _, ocr in fps]
         
         data = {
             'telegram_user_id': str(user_id),
             'telegram_user_name': user_name,
-            'sha256s': json.dumps(sha256s),
-            'ocr_hashes': json.dumps(ocr_hashes),
-            'phashes': json.dumps(phashes)
+            'sha256s': json_dumps(sha256s).decode(),
+            'ocr_hashes': json_dumps(ocr_hashes).decode(),
+            'phashes': json_dumps(phashes).decode()
         }
         
-        resp = requests.post(f'{BACKEND_URL}/telegram/upload', files=files, data=data, timeout=180)
-        logger.info(f'[UPLOAD_MULTIPLE] response status={resp.status_code}')
+        resp = post_multipart(f'{BACKEND_URL}/telegram/upload', data, files, timeout=180)
+        logger.info('[UPLOAD_MULTIPLE] response status=%s', resp.status_code)
         
-        result = resp.json() if resp.status_code == 200 else {'success': False, 'error': resp.text}
+        result = json_loads(resp.content) if resp.status_code == 200 else {'success': False, 'error': resp.text}
         if isinstance(result, list) and len(result) == 2:
             result = result[0]
         
-        logger.debug(f'[UPLOAD_MULTIPLE] result: {str(result)[:200]}')
+        logger.debug('[UPLOAD_MULTIPLE] result: %s', str(result)[:200])
         return result
     except Exception as e:
-        logger.error(f'[UPLOAD_MULTIPLE] error: {e}\n{traceback.format_exc()}')
+        logger.error('[UPLOAD_MULTIPLE] error: %s', e, exc_info=True)
         return {'success': False, 'error': str(e)}
 
 # ============================================================================
 # MESSAGE HANDLERS
 # ============================================================================
 
+# Independent network calls inside a handler (e.g. reaction + download)
+_IO_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='tg-io')
+
+# Fire-and-forget reactions, kept in order per message (⏳ never overwrites the final reaction)
+_reaction_tail: Dict[Tuple[int, int], Future] = {}
+_reaction_lock = threading.Lock()
+
+def _chained_reaction(prev: Optional[Future], chat_id: int, message_id: int, emoji: str) -> bool:
+    if prev is not None:
+        prev.exception()  # wait for the previous reaction (without raising its error)
+    return set_reaction(chat_id, message_id, emoji)
+
+def react(chat_id: int, message_id: int, emoji: str) -> Future:
+    """Set reaction in background, after any reaction still pending on the same message."""
+    key = (chat_id, message_id)
+    with _reaction_lock:
+        fut = _IO_POOL.submit(_chained_reaction, _reaction_tail.get(key), chat_id, message_id, emoji)
+        _reaction_tail[key] = fut
+    
+    def _cleanup(done: Future):
+        with _reaction_lock:
+            if _reaction_tail.get(key) is done:
+                del _reaction_tail[key]
+    fut.add_done_callback(_cleanup)
+    return fut
+
+# Photo/document handlers: bounded pool instead of one thread per message
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '16'))
+_WORKERS = ThreadPoolExecutor(max_workers=BOT_WORKERS, thread_name_prefix='tg-worker')
+
+# Albums (media_group_id): photos buffered for MEDIA_GROUP_WINDOW s and sent in a single upload
+MEDIA_GROUP_WINDOW = 1.5
 media_group_buffer = {}
+media_group_timers: Dict[str, threading.Timer] = {}
 media_group_lock = threading.Lock()
 
+_WHITELIST_MSG = ('🚫 **Cliente não encontrado na whitelist**\n\nID do cliente: `{user_id}`\n\n'
+                  'Por favor, contate um administrador do sistema ou realize o cadastro do cliente.')
+
+# Fixed command texts, built once
+_START_TEXT = (
+    '👋 Bem-vindo ao Fluxo-Cash Bot!\n\n'
+    '🆔 Seu ID: `{user_id}`\n'
+    '(Este é seu identificador no sistema)\n\n'
+    '📋 Como usar:\n'
+    '1. Envie uma foto ou PDF de um comprovante PIX\n'
+    '2. O bot extrairá os dados automaticamente\n'
+    '3. Seu crédito será atualizado em segundos\n\n'
+    'Use /help para mais informações.'
+)
+_HELP_TEXT = (
+    '📚 Ajuda - Fluxo-Cash Bot\n\n'
+    '**Comandos disponíveis:**\n'
+    '/start - Iniciar\n'
+    '/help - Esta mensagem\n'
+    '/id - Ver seu ID\n\n'
+    '**Para enviar comprovante:**\n'
+    'Envie uma foto ou PDF do comprovante PIX\n\n'
+    '**Dica:** Fotos claras funcionam melhor!'
+)
+_ID_TEXT = '🆔 Seu ID no Fluxo-Cash\n\n**ID Telegram:** `{user_id}`\n**Nome:** {first_name}\n\nEste é seu identificador único.'
+
 def handle_start(chat_id: int, user_id: int, first_name: str, is_group: bool):
     """Handle /start command."""
     if is_group:
-        logger.info(f'✅ /start in group by {first_name} (ID={user_id})')
+        logger.info('✅ /start in group by %s (ID=%s)', first_name, user_id)
         return
     
-    welcome = (
-        f'👋 Bem-vindo ao Fluxo-Cash Bot!\n\n'
-        f'🆔 Seu ID: `{user_id}`\n'
-        f'(Este é seu identificador no sistema)\n\n'
-        f'📋 Como usar:\n'
-        f'1. Envie uma foto ou PDF de um comprovante PIX\n'
-        f'2. O bot extrairá os dados automaticamente\n'
-        f'3. Seu crédito será atualizado em segundos\n\n'
-        f'Use /help para mais informações.'
-    )
-    send_message(chat_id, welcome)
-    logger.info(f'✅ /start in private from {first_name} (ID={user_id})')
+    send_message(chat_id, _START_TEXT.format(user_id=user_id))
+    logger.info('✅ /start in private from %s (ID=%s)', first_name, user_id)
 
 def handle_help(chat_id: int):
     """Handle /help command."""
-    help_text = (
-        '📚 Ajuda - Fluxo-Cash Bot\n\n'
-        '**Comandos disponíveis:**\n'
-        '/start - Iniciar\n'
-        '/help - Esta mensagem\n'
-        '/id - Ver seu ID\n\n'
-        '**Para enviar comprovante:**\n'
-        'Envie uma foto ou PDF do comprovante PIX\n\n'
-        '**Dica:** Fotos claras funcionam melhor!'
-    )
-    send_message(chat_id, help_text)
+    send_message(chat_id, _HELP_TEXT)
 
 def handle_id(chat_id: int, user_id: int, first_name: str):
     """Handle /id command."""
-    id_text = f'🆔 Seu ID no Fluxo-Cash\n\n**ID Telegram:** `{user_id}`\n**Nome:** {first_name}\n\nEste é seu identificador único.'
-    send_message(chat_id, id_text)
-    logger.info(f'✅ /id from {first_name} (ID={user_id})')
+    send_message(chat_id, _ID_TEXT.format(user_id=user_id, first_name=first_name))
+    logger.info('✅ /id from %s (ID=%s)', first_name, user_id)
 
 def is_client_id_not_found_error(error_msg: str) -> bool:
     """Check if error is related to client ID not found."""
     if not error_msg:
         return False
     lower_msg = error_msg.lower()
-    return ('client' in lower_msg and 'nao encontrado' in lower_msg) or \
-           ('cliente' in lower_msg and 'nao encontrado' in lower_msg) or \
-           ('cliente' in lower_msg and 'not found' in lower_msg) or \
-           ('whitelist' in lower_msg)
+    # 'client' already covers 'cliente'; rarer terms first so the check short-circuits early
+    return ('whitelist' in lower_msg) or \
+           ('nao encontrado' in lower_msg and 'client' in lower_msg) or \
+           ('not found' in lower_msg and 'cliente' in lower_msg)
+
+def _handle_upload_response(chat_id: int, message_id: int, user_id: int, response: Dict[str, Any]):
+    """Set reaction and reply according to backend upload response."""
+    processed = response.get('processed', [])
+    failed = response.get('failed', [])
+    
+    logger.debug('Response: processed=%s, failed=%s', len(processed), len(failed))
+    
+    # If at least one succeeded
+    if len(processed) > 0 and len(failed) == 0:
+        logger.info('✅ All files accepted')
+        react(chat_id, message_id, '✅')
+        for item in processed:
+            value = item.get('value', 0)
+            logger.info('✅ Accepted: user_id=%s, R$ %.2f', user_id, value)
+            reply_to_message(chat_id, message_id, f'✅ **Comprovante processado com sucesso!**\n\n💵 Valor creditado: R$ {value:.2f}')
+    # If mixed (some succeeded, some failed)
+    elif len(processed) > 0 and len(failed) > 0:
+        logger.info('⚠️ Partial success: %s ok, %s failed', len(processed), len(failed))
+        react(chat_id, message_id, '⚠️')
+        for item in processed:
+            value = item.get('value', 0)
+            reply_to_message(chat_id, message_id, f'✅ **Processado!** 💵 R$ {value:.2f}')
+        for f in failed:
+            ferr = f.get('error') or f.get('reason') or 'Unknown error'
+            if is_client_id_not_found_error(ferr):
+                react(chat_id, message_id, '🚫')
+                reply_to_message(chat_id, message_id, _WHITELIST_MSG.format(user_id=user_id))
+                logger.warning('🚫 Client ID not found: user_id=%s', user_id)
+            else:
+                logger.warning('⚠️ Partial fail: %s', ferr)
+                reply_to_message(chat_id, message_id, f'⚠️ {ferr}')
+    # All failed
+    else:
+        logger.warning('❌ All files rejected')
+        error_msg = response.get('detail') or response.get('error') or 'Processing error'
+        if len(failed) > 0:
+            error_msg = failed[0].get('error', 'Processing error')
+        
+        if is_client_id_not_found_error(error_msg):
+            react(chat_id, message_id, '🚫')
+            reply_to_message(chat_id, message_id, _WHITELIST_MSG.format(user_id=user_id))
+            logger.warning('🚫 Client ID not found: user_id=%s', user_id)
+        else:
+            react(chat_id, message_id, '❌')
+            reply_to_message(chat_id, message_id, f'❌ {error_msg}')
+            logger.warning('❌ Error: %s', error_msg)
 
 def handle_photo(chat_id: int, message_id: int, user_id: int, first_name: str, photo: List, is_group: bool):
     """Handle photo upload."""
-    set_reaction(chat_id, message_id, '⏳')
+    # ⏳ reaction in the background: the download starts without waiting for the round-trip
+    react(chat_id, message_id, '⏳')
     
     try:
         # Download
@@ -449,78 +643,35 @@ def handle_photo(chat_id: int, message_id: int, user_id: int, first_name: str, p
         file_bytes = download_file(file_id)
         
         if not file_bytes:
-            set_reaction(chat_id, message_id, '❌')
-            logger.error(f'Failed to download photo from {user_id}')
+            react(chat_id, message_id, '❌')
+            logger.error('Failed to download photo from %s', user_id)
             return
         
-        logger.info(f'📸 Photo from user_id={user_id} ({first_name}), group={is_group}')
+        logger.info('📸 Photo from user_id=%s (%s), group=%s', user_id, first_name, is_group)
         
         # Check duplicate
         is_dup, dup_info = is_duplicate_and_record(file_bytes, user_id, first_name)
         if is_dup:
             orig_uid = dup_info.get('original_user_id')
             orig_uname = dup_info.get('original_user_name', 'Desconhecido')
-            logger.info(f'🔁 Duplicate detected (method={dup_info.get("method")}): originally from user {orig_uid} ({orig_uname})')
-            set_reaction(chat_id, message_id, '🔁')
+            logger.info('🔁 Duplicate detected (method=%s): originally from user %s (%s)', dup_info.get("method"), orig_uid, orig_uname)
+            react(chat_id, message_id, '🔁')
             reply_to_message(chat_id, message_id, f'🔁 Este comprovante já foi enviado por **{orig_uname}** (ID: {orig_uid}) anteriormente.')
             return
         
         # Upload
         response = upload_to_backend(file_bytes, f'comprovante_{user_id}_{int(time.time())}.jpg', user_id, first_name)
         
-        # Handle response
-        processed = response.get('processed', [])
-        failed = response.get('failed', [])
-        
-        logger.debug(f'Response: processed={len(processed)}, failed={len(failed)}')
-        
-        # If at least one succeeded
-        if len(processed) > 0 and len(failed) == 0:
-            logger.info(f'✅ All files accepted')
-            set_reaction(chat_id, message_id, '✅')
-            for item in processed:
-                value = item.get('value', 0)
-                logger.info(f"✅ Accepted: user_id={user_id}, R$ {value:.2f}")
-                reply_to_message(chat_id, message_id, f'✅ **Comprovante processado com sucesso!**\n\n💵 Valor creditado: R$ {value:.2f}')
-        # If mixed (some succeeded, some failed)
-        elif len(processed) > 0 and len(failed) > 0:
-            logger.info(f'⚠️ Partial success: {len(processed)} ok, {len(failed)} failed')
-            set_reaction(chat_id, message_id, '⚠️')
-            for item in processed:
-                value = item.get('value', 0)
-                reply_to_message(chat_id, message_id, f'✅ **Processado!** 💵 R$ {value:.2f}')
-            for f in failed:
-                ferr = f.get('error') or f.get('reason') or 'Unknown error'
-                if is_client_id_not_found_error(ferr):
-                    set_reaction(chat_id, message_id, '🚫')
-                    reply_to_message(chat_id, message_id, f'🚫 **Cliente não encontrado na whitelist**\n\nID do cliente: `{user_id}`\n\nPor favor, contate um administrador do sistema ou realize o cadastro do cliente.')
-                    logger.warning(f'🚫 Client ID not found: user_id={user_id}')
-                else:
-                    logger.warning(f'⚠️ Partial fail: {ferr}')
-                    reply_to_message(chat_id, message_id, f'⚠️ {ferr}')
-        # All failed
-        else:
-            logger.warning(f'❌ All files rejected')
-            error_msg = response.get('detail') or response.get('error') or 'Processing error'
-            if len(failed) > 0:
-                error_msg = failed[0].get('error', 'Processing error')
-            
-            if is_client_id_not_found_error(error_msg):
-                set_reaction(chat_id, message_id, '🚫')
-                reply_to_message(chat_id, message_id, f'🚫 **Cliente não encontrado na whitelist**\n\nID do cliente: `{user_id}`\n\nPor favor, contate um administrador do sistema ou realize o cadastro do cliente.')
-                logger.warning(f'🚫 Client ID not found: user_id={user_id}')
-            else:
-                set_reaction(chat_id, message_id, '❌')
-                reply_to_message(chat_id, message_id, f'❌ {error_msg}')
-                logger.warning(f'❌ Error: {error_msg}')
+        _handle_upload_response(chat_id, message_id, user_id, response)
     
     except Exception as e:
-        set_reaction(chat_id, message_id, '❌')
-        logger.error(f'handle_photo error: {e}\n{traceback.format_exc()}')
+        react(chat_id, message_id, '❌')
+        logger.error('handle_photo error: %s', e, exc_info=True)
 
 def handle_document(chat_id: int, message_id: int, user_id: int, first_name: str, document: Dict, is_group: bool):
     """Handle PDF document upload."""
-    set_reaction(chat_id, message_id, '⏳')
+    # ⏳ reaction in the background: the download starts without waiting for the round-trip
+    react(chat_id, message_id, '⏳')
     
     try:
         # Download
@@ -528,124 +679,206 @@ def handle_document(chat_id: int, message_id: int, user_id: int, first_name: str
         file_bytes = download_file(file_id)
         
         if not file_bytes:
-            set_reaction(chat_id, message_id, '❌')
-            logger.error(f'Failed to download PDF from {user_id}')
+            react(chat_id, message_id, '❌')
+            logger.error('Failed to download PDF from %s', user_id)
             return
         
-        logger.info(f'📄 PDF from user_id={user_id} ({first_name}), group={is_group}')
+        logger.info('📄 PDF from user_id=%s (%s), group=%s', user_id, first_name, is_group)
         
         # Check duplicate
         is_dup, dup_info = is_duplicate_and_record(file_bytes, user_id, first_name)
         if is_dup:
             orig_uid = dup_info.get('original_user_id')
             orig_uname = dup_info.get('original_user_name', 'Desconhecido')
-            logger.info(f'🔁 Duplicate detected (method={dup_info.get("method")}): originally from user {orig_uid} ({orig_uname})')
-            set_reaction(chat_id, message_id, '🔁')
+            logger.info('🔁 Duplicate detected (method=%s): originally from user %s (%s)', dup_info.get("method"), orig_uid, orig_uname)
+            react(chat_id, message_id, '🔁')
             reply_to_message(chat_id, message_id, f'🔁 Este comprovante já foi enviado por **{orig_uname}** (ID: {orig_uid}) anteriormente.')
             return
         
         # Upload
         response = upload_to_backend(file_bytes, document.get('file_name', 'documento.pdf'), user_id, first_name)
         
-        # Handle response (same logic as photo)
+        _handle_upload_response(chat_id, message_id, user_id, response)
+    
+    except Exception as e:
+        react(chat_id, message_id, '❌')
+        logger.error('handle_document error: %s', e, exc_info=True)
+
+def buffer_media_group_photo(group_id: str, file_id: str, chat_id: int, message_id: int, user_id: int, first_name: str):
+    """Add album photo to buffer; first entry schedules the flush."""
+    with media_group_lock:
+        entries = media_group_buffer.setdefault(group_id, [])
+        entries.append((file_id, chat_id, message_id, user_id, first_name))
+        if len(entries) == 1:
+            timer = threading.Timer(MEDIA_GROUP_WINDOW, _schedule_media_group_flush, args=(group_id,))
+            timer.daemon = True
+            media_group_timers[group_id] = timer
+            timer.start()
+
+def _schedule_media_group_flush(group_id: str):
+    """Timer callback: only schedules, album download/fingerprint/upload run on the bounded pool."""
+    with media_group_lock:
+        media_group_timers.pop(group_id, None)
+    try:
+        _WORKERS.submit(_flush_media_group, group_id)
+    except RuntimeError:
+        # Pool already shut down: flush here rather than drop the album
+        logger.warning('Worker pool closed, flushing media group %s inline', group_id)
+        _flush_media_group(group_id)
+
+def _flush_media_group(group_id: str):
+    """Download all photos of an album and upload them in one request."""
+    with media_group_lock:
+        entries = media_group_buffer.pop(group_id, [])
+    if not entries:
+        return
+    
+    _, chat_id, _, user_id, first_name = entries[0]
+    message_ids = [e[2] for e in entries]
+    logger.info('🖼️ Media group %s: %s photos from user_id=%s (%s)', group_id, len(entries), user_id, first_name)
+    
+    try:
+        for mid in message_ids:
+            react(chat_id, mid, '⏳')
+        blobs = list(_IO_POOL.map(download_file, [e[0] for e in entries]))
+        
+        files_list, upload_ids = [], []
+        for mid, file_bytes in zip(message_ids, blobs):
+            if not file_bytes:
+                react(chat_id, mid, '❌')
+                logger.error('Failed to download photo from %s', user_id)
+                continue
+            is_dup, dup_info = is_duplicate_and_record(file_bytes, user_id, first_name)
+            if is_dup:
+                orig_uid = dup_info.get('original_user_id')
+                orig_uname = dup_info.get('original_user_name', 'Desconhecido')
+                logger.info('🔁 Duplicate detected (method=%s): originally from user %s (%s)', dup_info.get("method"), orig_uid, orig_uname)
+                react(chat_id, mid, '🔁')
+                reply_to_message(chat_id, mid, f'🔁 Este comprovante já foi enviado por **{orig_uname}** (ID: {orig_uid}) anteriormente.')
+                continue
+            files_list.append((file_bytes, f'comprovante_{user_id}_{int(time.time())}_{len(files_list) + 1}.jpg'))
+            upload_ids.append(mid)
+        
+        if not files_list:
+            return
+        
+        response = upload_multiple_to_backend(files_list, user_id, first_name)
         processed = response.get('processed', [])
         failed = response.get('failed', [])
+        logger.debug('Response: processed=%s, failed=%s', len(processed), len(failed))
         
-        logger.debug(f'Response: processed={len(processed)}, failed={len(failed)}')
+        # One aggregated reply for the album, a reaction on each photo
+        lines = []
+        if processed:
+            total = sum(item.get('value', 0) for item in processed)
+            logger.info('✅ Accepted: user_id=%s, %s files, R$ %.2f', user_id, len(processed), total)
+            lines.append(f'✅ **{len(processed)} comprovante(s) processado(s)!**\n\n💵 Total creditado: R$ {total:.2f}')
         
-        # If at least one succeeded
-        if len(processed) > 0 and len(failed) == 0:
-            logger.info(f'✅ All files accepted')
-            set_reaction(chat_id, message_id, '✅')
-            for item in processed:
-                value = item.get('value', 0)
-                logger.info(f"✅ Accepted: user_id={user_id}, R$ {value:.2f}")
-                reply_to_message(chat_id, message_id, f'✅ **Comprovante processado com sucesso!**\n\n💵 Valor creditado: R$ {value:.2f}')
-        # If mixed (some succeeded, some failed)
-        elif len(processed) > 0 and len(failed) > 0:
-            logger.info(f'⚠️ Partial success: {len(processed)} ok, {len(failed)} failed')
-            set_reaction(chat_id, message_id, '⚠️')
-            for item in processed:
-                value = item.get('value', 0)
-                reply_to_message(chat_id, message_id, f'✅ **Processado!** 💵 R$ {value:.2f}')
-            for f in failed:
-                ferr = f.get('error') or f.get('reason') or 'Unknown error'
-                if is_client_id_not_found_error(ferr):
-                    set_reaction(chat_id, message_id, '🚫')
-                    reply_to_message(chat_id, message_id, f'🚫 **Cliente não encontrado na whitelist**\n\nID do cliente: `{user_id}`\n\nPor favor, contate um administrador do sistema ou realize o cadastro do cliente.')
-                    logger.warning(f'🚫 Client ID not found: user_id={user_id}')
-                else:
-                    logger.warning(f'⚠️ Partial fail: {ferr}')
-                    reply_to_message(chat_id, message_id, f'⚠️ {ferr}')
-        # All failed
+        errors = [f.get('error') or f.get('reason') or 'Unknown error' for f in failed]
+        if not processed and not errors:
+            errors = [response.get('detail') or response.get('error') or 'Processing error']
+        whitelist = any(is_client_id_not_found_error(e) for e in errors)
+        if whitelist:
+            logger.warning('🚫 Client ID not found: user_id=%s', user_id)
+            lines.append(_WHITELIST_MSG.format(user_id=user_id))
+        for err in errors:
+            if not is_client_id_not_found_error(err):
+                logger.warning('⚠️ Media group fail: %s', err)
+                lines.append(f'⚠️ {err}' if processed else f'❌ {err}')
+        
+        if processed:
+            reaction = '⚠️' if errors else '✅'
         else:
-            logger.warning(f'❌ All files rejected')
-            error_msg = response.get('detail') or response.get('error') or 'Processing error'
-            if len(failed) > 0:
-                error_msg = failed[0].get('error', 'Processing error')
-            
-            if is_client_id_not_found_error(error_msg):
-                set_reaction(chat_id, message_id, '🚫')
-                reply_to_message(chat_id, message_id, f'🚫 **Cliente não encontrado na whitelist**\n\nID do cliente: `{user_id}`\n\nPor favor, contate um administrador do sistema ou realize o cadastro do cliente.')
-                logger.warning(f'🚫 Client ID not found: user_id={user_id}')
-            else:
-                set_reaction(chat_id, message_id, '❌')
-                reply_to_message(chat_id, message_id, f'❌ {error_msg}')
-                logger.warning(f'❌ Error: {error_msg}')
+            reaction = '🚫' if whitelist else '❌'
+        for mid in upload_ids:
+            react(chat_id, mid, reaction)
+        reply_to_message(chat_id, upload_ids[0], '\n\n'.join(lines))
     
     except Exception as e:
-        set_reaction(chat_id, message_id, '❌')
-        logger.error(f'handle_document error: {e}\n{traceback.format_exc()}')
+        for mid in message_ids:
+            react(chat_id, mid, '❌')
+        logger.error('_flush_media_group error: %s', e, exc_info=True)
+
+def shutdown_workers():
+    """Flush buffered albums, then wait for in-flight photo/document/album handlers to finish."""
+    with media_group_lock:
+        pending = list(media_group_timers.items())
+        media_group_timers.clear()
+    for group_id, timer in pending:
+        timer.cancel()
+        _WORKERS.submit(_flush_media_group, group_id)
+    _WORKERS.shutdown(wait=True)
 
 # ============================================================================
 # POLLING & UPDATE PROCESSING
 # ============================================================================
 
-last_update_id = None
+POLL_BACKOFF_MIN = 0.25
+POLL_BACKOFF_MAX = 8.0
 
-def get_updates(timeout: int = 30) -> List[Dict]:
-    """Poll for updates."""
-    global last_update_id
-    try:
-        resp = requests.get(
-            f'{TELEGRAM_API}/getUpdates',
-            params={'offset': last_update_id, 'timeout': timeout, 'allowed_updates': ['message']},
-            timeout=timeout + 5
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get('ok'):
-                return data.get('result', [])
-    except Exception as e:
-        logger.error(f'get_updates error: {e}')
-    
-    return []
+class RetryAfter(Exception):
+    """Telegram 429: wait `seconds` before polling again."""
+    def __init__(self, seconds: float):
+        super().__init__(f'rate limited, retry after {seconds}s')
+        self.seconds = seconds
 
-def process_update(update: Dict):
-    """Process single update."""
-    global last_update_id
-    
-    update_id = update.get('update_id')
-    last_update_id = update_id + 1
+def _retry_after_seconds(resp: requests.Response) -> float:
+    """Retry-After header, else Telegram's parameters.retry_after, else 1s."""
+    try:
+        return float(resp.headers['Retry-After'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return float(json_loads(resp.content)['parameters']['retry_after'])
+    except Exception:
+        return 1.0
+
+_ALLOWED_UPDATES = ('message',)
+_POLL_PARAMS_TEMPLATE = {'timeout': 30, 'allowed_updates': _ALLOWED_UPDATES}
+
+def get_updates(offset: Optional[int] = None, timeout: int = 30) -> List[Dict]:
+    """Poll for updates. Raises on failure so the caller can back off."""
+    params = dict(_POLL_PARAMS_TEMPLATE, timeout=timeout)
+    if offset is not None:
+        params['offset'] = offset
+    # Short connect timeout detects a dead connection without waiting for the whole long poll
+    resp = request_updates(params, timeout=(5, timeout + 2))
+    if resp.status_code == 429:
+        raise RetryAfter(_retry_after_seconds(resp))
+    resp.raise_for_status()
+    data = json_loads(resp.content)
+    if not data.get('ok'):
+        raise RuntimeError(f'getUpdates not ok: {data.get("description")}')
+    return data.get('result', [])
+
+# Shared read-only fallback for fields missing from the update
+_EMPTY = MappingProxyType({})
+_GROUP_CHAT_TYPES = frozenset(('group', 'supergroup'))
+
+def process_update(update: Dict) -> int:
+    """Process single update. Returns the next getUpdates offset."""
+    next_offset = update.get('update_id') + 1
     
     message = update.get('message')
     if not message:
-        return
+        return next_offset
     
-    chat_id = message.get('chat', {}).get('id')
-    chat_type = message.get('chat', {}).get('type', 'private')
-    user_id = message.get('from', {}).get('id')
-    first_name = message.get('from', {}).get('first_name', 'User')
+    chat = message.get('chat') or _EMPTY
+    sender = message.get('from') or _EMPTY
+    chat_id = chat.get('id')
+    chat_type = chat.get('type', 'private')
+    user_id = sender.get('id')
+    first_name = sender.get('first_name', 'User')
     message_id = message.get('message_id')
     
     if not first_name or first_name == 'Group':
-        username = message.get('from', {}).get('username')
+        username = sender.get('username')
         first_name = username or f'User_{user_id}'
     
-    is_group = chat_type in ['group', 'supergroup']
+    is_group = chat_type in _GROUP_CHAT_TYPES
     
     if not all([chat_id, user_id]):
-        return
+        return next_offset
     
     # Process text commands
     text = message.get('text', '').strip()
@@ -657,71 +890,96 @@ def process_update(update: Dict):
     elif text.startswith('/id'):
         handle_id(chat_id, user_id, first_name)
     
-    # Process photo (in background thread to avoid blocking polling)
+    # Process photo (in worker pool to avoid blocking polling)
     if 'photo' in message:
         photo = message.get('photo')
-        t = threading.Thread(target=handle_photo, args=(chat_id, message_id, user_id, first_name, photo, is_group), daemon=True)
-        t.start()
+        group_id = message.get('media_group_id')
+        if group_id:
+            buffer_media_group_photo(group_id, photo[-1]['file_id'], chat_id, message_id, user_id, first_name)
+            return next_offset
+        _WORKERS.submit(handle_photo, chat_id, message_id, user_id, first_name, photo, is_group)
     
-    # Process document (in background thread to avoid blocking polling)
+    # Process document (in worker pool to avoid blocking polling)
     elif 'document' in message:
         document = message.get('document')
         if document.get('mime_type') == 'application/pdf':
-            t = threading.Thread(target=handle_document, args=(chat_id, message_id, user_id, first_name, document, is_group), daemon=True)
-            t.start()
+            _WORKERS.submit(handle_document, chat_id, message_id, user_id, first_name, document, is_group)
         else:
-            logger.warning(f'Non-PDF document ignored: {document.get("mime_type")}')
+            logger.warning('Non-PDF document ignored: %s', document.get("mime_type"))
+    
+    return next_offset
 
 # ============================================================================
 # MAIN LOOP
 # ============================================================================
 
+def _on_sigterm(signum, frame):
+    # Railway sends SIGTERM on restart; Python's default exits without running atexit
+    # (the bloom filter would not be saved nor the sessions closed)
+    raise SystemExit(0)
+
 def main():
     """Main polling loop."""
     logger.info('=' * 70)
     logger.info('🤖 TELEGRAM BOT - FLUXO CASH v3 (Refeito)')
     logger.info('=' * 70)
-    logger.info(f'Token: {TELEGRAM_TOKEN[:20]}...')
-    logger.info(f'Backend: {BACKEND_URL}')
-    logger.info(f'pHash threshold: {PHASH_THRESHOLD}')
-    logger.info(f'Log file: {BOT_LOG_FILE}')
+    logger.info('Token: %s...', TELEGRAM_TOKEN[:20])
+    logger.info('Backend: %s', BACKEND_URL)
+    logger.info('pHash threshold: %s', PHASH_THRESHOLD)
+    logger.info('Log file: %s', BOT_LOG_FILE)
     logger.info('=' * 70)
     
     # Test connection
     try:
-        resp = requests.get(f'{TELEGRAM_API}/getMe', timeout=5)
-        if resp.status_code == 200:
-            bot_info = resp.json()
-            if bot_info.get('ok'):
-                bot_name = bot_info['result'].get('username', 'Bot')
-                logger.info(f'✅ Connected: @{bot_name}')
+        bot_info = get_me()
+        if bot_info:
+            bot_name = bot_info.get('username', 'Bot')
+            logger.info('✅ Connected: @%s', bot_name)
     except Exception as e:
-        logger.error(f'❌ Connection failed: {e}')
+        logger.error('❌ Connection failed: %s', e)
         return
     
     logger.info('✅ Bot ready! Waiting for messages...\n')
     
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    
     # Polling loop
+    backoff = POLL_BACKOFF_MIN
+    offset = None
     try:
         while True:
             try:
-                updates = get_updates(timeout=30)
-                
-                for update in updates:
-                    try:
-                        process_update(update)
-                    except Exception as e:
-                        logger.error(f'Update processing error: {e}\n{traceback.format_exc()}')
-                
-                if not updates:
-                    logger.debug('No new updates.')
-                    
+                updates = get_updates(offset, timeout=30)
+            except RetryAfter as e:
+                logger.warning('⏳ Telegram rate limit: waiting %.0fs', e.seconds)
+                time.sleep(e.seconds)
+                continue
             except Exception as e:
-                logger.error(f'Polling error: {e}')
-                time.sleep(1)
+                # Exponential backoff on transient errors (5xx, network)
+                logger.error('Polling error: %s (retry in %.2fs)', e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                continue
+            backoff = POLL_BACKOFF_MIN
+            
+            for update in updates:
+                try:
+                    next_offset = process_update(update)
+                except Exception as e:
+                    # Advance anyway: a failing update must not be reprocessed forever
+                    update_id = update.get('update_id')
+                    next_offset = update_id + 1 if isinstance(update_id, int) else None
+                    logger.error('Update processing error: %s', e, exc_info=True)
+                if next_offset is not None:
+                    offset = max(offset or 0, next_offset)
+            
+            if not updates:
+                logger.debug('No new updates.')
     
-    except KeyboardInterrupt:
-        logger.info('\n✅ Bot stopped by user.')
+    except (KeyboardInterrupt, SystemExit):
+        logger.info('\n✅ Bot stopped.')
+        # In-flight uploads finish before exiting
+        shutdown_workers()
 
 if __name__ == '__main__':
     main()
@@ -1,210 +1,98 @@
 """
 Telegram Webhook Handler
-Processa updates do Telegram sem precisar de polling
+Processa updates do Telegram sem precisar de polling, com os mesmos handlers do
+bot de polling (telegram_bot_simple): dedup SHA256/pHash/OCR, álbuns e reações.
+
+Modo web (opcional, requer fastapi + uvicorn):
+  uvicorn app.telegram_webhook:app --host 0.0.0.0 --port $PORT
+  PUBLIC_URL: URL pública do serviço; no startup registra {PUBLIC_URL}/telegram/webhook via setWebhook
+  TELEGRAM_WEBHOOK_SECRET: (opcional) validado no header X-Telegram-Bot-Api-Secret-Token
 """
+import asyncio
+import hmac
 import logging
-import requests
-import io
 import os
+from contextlib import asynccontextmanager
 from typing import Dict, Any
 
-logger = logging.getLogger(__name__)
-
-# Read token from environment (do not hardcode in source)
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-if TELEGRAM_TOKEN:
-    TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}"
-else:
-    TELEGRAM_API = None
-    logger.warning('TELEGRAM_TOKEN not set in environment; Telegram API calls will fail until token is provided')
+# Mesmo cliente HTTP (pool de conexões) do bot de polling
+try:
+    from .telegram_api import json_loads, set_webhook
+except ImportError:
+    from telegram_api import json_loads, set_webhook
 
+try:
+    from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request
+except ImportError:
+    FastAPI = None
 
-def send_reaction(chat_id: int, message_id: int, emoji: str = "✅"):
-    """Enviar reação para mensagem"""
-    try:
-        requests.post(
-            f"{TELEGRAM_API}/setMessageReaction",
-            json={
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "reaction": [{"type": "emoji", "emoji": emoji}]
-            },
-            timeout=5
-        )
-    except Exception as e:
-        logger.error(f"Erro ao enviar reação: {e}")
-
+logger = logging.getLogger(__name__)
 
-def send_message(chat_id: int, text: str, reply_to: int = None):
-    """Enviar mensagem de texto"""
-    try:
-        payload = {
-            "chat_id": chat_id,
-            "text": text,
-            "parse_mode": "Markdown"
-        }
-        if reply_to:
-            payload["reply_to_message_id"] = reply_to
-            
-        requests.post(
-            f"{TELEGRAM_API}/sendMessage",
-            json=payload,
-            timeout=10
-        )
-    except Exception as e:
-        logger.error(f"Erro ao enviar mensagem: {e}")
+WEBHOOK_PATH = '/telegram/webhook'
+PUBLIC_URL = os.getenv('PUBLIC_URL')
+WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET')
 
 
-def download_file(file_id: str) -> bytes:
-    """Baixar arquivo do Telegram"""
+def _bot():
+    """Módulo do bot de polling, importado só no primeiro uso: a importação valida o
+    TELEGRAM_TOKEN, abre o bot.log, inicia os pools e carrega o bloom filter."""
     try:
-        # Obter file_path
-        response = requests.get(
-            f"{TELEGRAM_API}/getFile",
-            params={"file_id": file_id},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            file_info = response.json()
-            if file_info.get('ok'):
-                file_path = file_info['result']['file_path']
-                file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}"
-                
-                # Baixar arquivo
-                file_response = requests.get(file_url, timeout=30)
-                return file_response.content
-    except Exception as e:
-        logger.error(f"Erro ao baixar arquivo: {e}")
-    
-    return None
+        from . import telegram_bot_simple
+    except ImportError:
+        import telegram_bot_simple
+    return telegram_bot_simple
 
 
-async def process_telegram_update(update: Dict[str, Any], backend_url: str):
+async def process_telegram_update(update: Dict[str, Any]):
     """
-    Processar update do Telegram
+    Processar update do Telegram pelo mesmo dispatch do bot de polling
     """
     try:
-        message = update.get('message')
-        if not message:
-            return {"ok": True}
-        
-        chat_id = message.get('chat', {}).get('id')
-        message_id = message.get('message_id')
-        user_id = message.get('from', {}).get('id')
-        first_name = message.get('from', {}).get('first_name', 'Usuário')
-        text = message.get('text', '').strip()
-        
-        # Processar comandos
-        if text.startswith('/start'):
-            welcome = (
-                f"👋 Bem-vindo ao Fluxo-Cash Bot!\n\n"
-                f"🆔 Seu ID: `{user_id}`\n\n"
-                f"📸 Envie comprovantes PIX (foto ou PDF)\n"
-                f"Use /help para mais informações."
-            )
-            send_message(chat_id, welcome)
-            return {"ok": True}
-        
-        elif text.startswith('/help'):
-            help_text = (
-                "📚 Ajuda - Fluxo-Cash Bot\n\n"
-                "**Comandos:**\n"
-                "/start - Iniciar\n"
-                "/help - Ajuda\n"
-                "/id - Ver seu ID\n\n"
-                "**Enviar comprovante:**\n"
-                "Envie foto ou PDF do comprovante PIX"
-            )
-            send_message(chat_id, help_text)
-            return {"ok": True}
-        
-        elif text.startswith('/id'):
-            send_message(chat_id, f"🆔 Seu ID: `{user_id}`")
-            return {"ok": True}
-        
-        # Ensure backend_url falls back to production if not provided
-        if not backend_url:
-            backend_url = os.getenv('BACKEND_URL', 'https://new-bot-nader-production.up.railway.app')
-
-        # Processar foto
-        if 'photo' in message:
-            send_reaction(chat_id, message_id, "⏳")
-            
-            photo = message['photo'][-1]  # Maior resolução
-            file_bytes = download_file(photo['file_id'])
-            
-            if file_bytes:
-                # Upload para backend
-                response = await upload_to_backend(
-                    file_bytes=file_bytes,
-                    filename=f"comprovante_{user_id}.jpg",
-                    user_id=user_id,
-                    user_name=first_name,
-                        backend_url=backend_url
-                )
-                
-                # Processar resposta
-                if response.get('processed'):
-                    send_reaction(chat_id, message_id, "✅")
-                else:
-                    send_reaction(chat_id, message_id, "❌")
-            else:
-                send_reaction(chat_id, message_id, "❌")
-        
-        # Processar documento (PDF)
-        elif 'document' in message:
-            document = message['document']
-            if document.get('mime_type') == 'application/pdf':
-                send_reaction(chat_id, message_id, "⏳")
-                
-                file_bytes = download_file(document['file_id'])
-                
-                if file_bytes:
-                    response = await upload_to_backend(
-                        file_bytes=file_bytes,
-                        filename=document.get('file_name', 'documento.pdf'),
-                        user_id=user_id,
-                        user_name=first_name,
-                        backend_url=backend_url
-                    )
-                    
-                    if response.get('processed'):
-                        send_reaction(chat_id, message_id, "✅")
-                    else:
-                        send_reaction(chat_id, message_id, "❌")
-                else:
-                    send_reaction(chat_id, message_id, "❌")
-        
+        # process_update faz os comandos na hora e enfileira fotos/PDFs/álbuns nos workers
+        await asyncio.to_thread(_bot().process_update, update)
         return {"ok": True}
         
     except Exception as e:
-        logger.error(f"Erro ao processar update: {e}")
+        logger.error("Erro ao processar update: %s", e, exc_info=True)
         return {"ok": False, "error": str(e)}
 
 
-async def upload_to_backend(file_bytes: bytes, filename: str, user_id: int, user_name: str, backend_url: str):
-    """Upload para o backend"""
-    import asyncio
-    
-    def _upload():
+# ============================================================================
+# FASTAPI APP (modo webhook)
+# ============================================================================
+
+if FastAPI is not None:
+    @asynccontextmanager
+    async def _lifespan(_app):
+        bot = _bot()
+        if PUBLIC_URL:
+            url = PUBLIC_URL.rstrip('/') + WEBHOOK_PATH
+            if await asyncio.to_thread(set_webhook, url, WEBHOOK_SECRET):
+                logger.info('✅ Webhook registrado: %s', url)
+        else:
+            logger.warning('PUBLIC_URL not set; webhook not registered with Telegram')
+        yield
+        # Uploads em andamento terminam antes de sair
+        await asyncio.to_thread(bot.shutdown_workers)
+
+    app = FastAPI(lifespan=_lifespan)
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request, background_tasks: BackgroundTasks,
+                               x_telegram_bot_api_secret_token: str = Header(None)):
+        """Recebe o update e responde na hora; o processamento roda em background
+        (o Telegram reenvia o update se a resposta demorar)."""
+        # Comparação em tempo constante (não vaza o segredo por timing)
+        if WEBHOOK_SECRET and not hmac.compare_digest((x_telegram_bot_api_secret_token or '').encode(),
+                                                      WEBHOOK_SECRET.encode()):
+            raise HTTPException(status_code=403, detail='invalid secret token')
         try:
-            files = {'files': (filename, io.BytesIO(file_bytes))}
-            data = {
-                'telegram_user_id': str(user_id),
-                'telegram_user_name': user_name
-            }
-            
-            response = requests.post(
-                f"{backend_url}/telegram/upload",
-                files=files,
-                data=data,
-                timeout=120
-            )
-            
-            return response.json()
-        except Exception as e:
-            logger.error(f"Erro no upload: {e}")
-            return {"success": False, "error": str(e)}
-    
-    return await asyncio.to_thread(_upload)
+            update = json_loads(await request.body())
+        except ValueError:  # json.JSONDecodeError / orjson.JSONDecodeError
+            raise HTTPException(status_code=400, detail='invalid JSON body')
+        if not isinstance(update, dict):
+            raise HTTPException(status_code=400, detail='update must be a JSON object')
+        background_tasks.add_task(process_telegram_update, update)
+        return {"ok": True}
+else:
+    app = None